@@ -0,0 +1,62 @@
+""" Aho–Corasick multi-pattern string matching.
+
+    Finds every occurrence of any of a set of patterns in a text in a single pass over the text, so
+    the cost of a search depends on the length of the text and the number of matches, not on the
+    number of patterns.
+"""
+from collections import deque
+from typing import Iterable, Iterator, Tuple
+
+
+class AhoCorasick(object):
+  """ Automaton for a fixed list of patterns. Matches are reported by index into that list.
+  """
+
+  def __init__(self, patterns: Iterable[str]):
+    self.patterns = list(patterns)
+    self._goto = [dict()]   # Trie edges, by node
+    self._fail = [0]        # Longest proper suffix of a node’s string that is also in the trie
+    self._output = [[]]     # Indexes of the patterns that end at a node
+
+    for index, pattern in enumerate(self.patterns):
+      node = 0
+      for char in pattern:
+        next_node = self._goto[node].get(char)
+        if next_node is None:
+          next_node = len(self._goto)
+          self._goto[node][char] = next_node
+          self._goto.append(dict())
+          self._fail.append(0)
+          self._output.append([])
+        node = next_node
+      self._output[node].append(index)
+
+    # Breadth-first, so a node’s failure link is set before those of its children.
+    queue = deque(self._goto[0].values())
+    while queue:
+      node = queue.popleft()
+      for char, child in self._goto[node].items():
+        queue.append(child)
+        fail = self._fail[node]
+        while fail and char not in self._goto[fail]:
+          fail = self._fail[fail]
+        self._fail[child] = self._goto[fail].get(char, 0)
+        self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+  def matches(self, text: str) -> Iterator[Tuple[int, int]]:
+    """ Yield (end, index) for each occurrence of patterns[index] in text, where end is the position
+        just past the end of the occurrence.
+    """
+    goto, fail, output = self._goto, self._fail, self._output
+    node = 0
+    for position, char in enumerate(text, 1):
+      while node and char not in goto[node]:
+        node = fail[node]
+      node = goto[node].get(char, 0)
+      for index in output[node]:
+        yield position, index
+
+  def first_pattern(self, text: str):
+    """ Return the lowest index of any pattern that occurs in text, or None if none does.
+    """
+    return min((index for end, index in self.matches(text)), default=None)
@@ -0,0 +1,135 @@
+#! /usr/local/bin/python3
+""" Compare the speed of details_parser.parse_details() with the line-filter-and-inline-regex parser
+    it replaced, using a corpus of saved NYSED program details pages.
+
+    The corpus is a directory of saved pages: either the cache directory written by
+    registered_programs.py --cache-dir (only IRPSL3 pages are used), or any directory of .html or
+    .txt files saved from http://www.nysed.gov/COMS/RP090/IRPSL3?PROGCD=nnnnn.
+
+    Both parsers must produce the same records for every page; institution names are left as names
+    rather than translated to ids, so no database is needed.
+"""
+import argparse
+import json
+import re
+import sys
+import time
+
+from pathlib import Path
+
+from details_parser import (parse_details, fix_title, Variant_Line, Not_Granting, For_Award,
+                            Certificate, Eligibility, Accreditation, Registration_Dates)
+
+
+# Legacy parser
+# -------------------------------------------------------------------------------------------------
+def detail_lines(all_lines):
+  lines = all_lines.splitlines()
+  for line in lines:
+    if re.search(r'^\s+\d{5}\s+|FOR AWARD|PROGRAM|CERTIFICATE|M/A|M/I', line):
+      yield line.replace('<H4><PRE>', '').strip()
+
+
+def legacy_parse_details(page):
+  records = []
+  program_award = None
+  for_award = None
+  for line in detail_lines(page.replace('\x1e', '')):
+    tokens = line.split()
+    token = tokens[0]
+    if token.isdecimal() or token == 'M/A':
+      matches = re.match(r'\s*(\d+|M/A)\s+(.+)(\d{4}\.\d{2})\s+(\S+\s?\S*)\s+(.+)', line)
+      program_award = matches.group(4).strip()
+      records.append(Variant_Line(program_award, matches.group(3), matches.group(5),
+                                  fix_title(matches.group(2))))
+      continue
+    if token == 'M/I':
+      if 'NOT-GRANTING' in line:
+        matches = re.search(r'NOT-GRANTING\s+(.+)', line)
+        records.append(Not_Granting(program_award, [matches.group(1).strip()]))
+      else:
+        matches = re.search(r'(\d{4}.\d{2})\s+(\S+\s?\S*)\s+(.*)', line)
+        program_award = matches.group(2).strip()
+        records.append(Variant_Line(program_award, matches.group(1), matches.group(3).strip(),
+                                    None))
+      continue
+    if token == 'FOR':
+      for_award = re.match(r'\s*FOR AWARD\s*--(.*)', line).group(1).strip()
+      records.append(For_Award(for_award))
+      continue
+    if for_award is None:
+      continue
+    if token.startswith('CERTIFICATE'):
+      cert_info = re.sub(r'\s+', ' ', line.split(':')[1].strip())
+      if cert_info.startswith('NONE'):
+        cert_info = ''
+      records.append(Certificate(cert_info))
+      continue
+    if token == 'PROGRAM' and tokens[1] == 'FINANCIAL':
+      matches = re.search(r'(YES|NO).+(YES|NO).+(YES|NO)', line)
+      records.append(Eligibility(matches.group(1), matches.group(2), matches.group(3)))
+      continue
+    if token == 'PROGRAM' and tokens[1] == 'PROFESSIONAL':
+      records.append(Accreditation(line.split(':')[1].strip()))
+      continue
+    if token == 'PROGRAM' and tokens[1] == 'FIRST':
+      matches = re.search(r'DATE:\s+(\S+).+ACTION:\s+(\S+)', line)
+      records.append(Registration_Dates(matches[1], matches[2]))
+  return records
+
+
+# load_corpus()
+# -------------------------------------------------------------------------------------------------
+def load_corpus(directory):
+  """ Return a list of the page texts in directory.
+  """
+  pages = []
+  for path in sorted(Path(directory).iterdir()):
+    if path.suffix == '.body':
+      try:
+        meta = json.loads(path.with_suffix('.json').read_text(encoding='utf-8'))
+      except (OSError, ValueError):
+        continue
+      if 'IRPSL3' in meta['url']:
+        pages.append(str(path.read_bytes(), meta['encoding'] or 'ISO-8859-1', errors='replace'))
+    elif path.suffix in ('.html', '.txt'):
+      pages.append(path.read_text(encoding='iso-8859-1'))
+  return pages
+
+
+# best_time()
+# -------------------------------------------------------------------------------------------------
+def best_time(parser, pages, repeat):
+  """ Best of repeat runs of parser over all pages, in seconds.
+  """
+  best = None
+  for i in range(repeat):
+    start = time.perf_counter()
+    for page in pages:
+      parser(page)
+    elapsed = time.perf_counter() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the IRPSL3 details page parser.')
+  parser.add_argument('corpus', help='directory of saved details pages')
+  parser.add_argument('-r', '--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  pages = load_corpus(args.corpus)
+  if len(pages) == 0:
+    sys.exit(f'No details pages in {args.corpus}')
+
+  for page in pages:
+    assert parse_details(page) == legacy_parse_details(page), 'Parsers disagree'
+
+  num_bytes = sum(len(page) for page in pages)
+  legacy_time = best_time(legacy_parse_details, pages, args.repeat)
+  new_time = best_time(parse_details, pages, args.repeat)
+  print(f'{len(pages):,} pages, {num_bytes:,} characters; best of {args.repeat} runs')
+  print(f'  legacy parser: {legacy_time:8.4f} sec ({1e6 * legacy_time / len(pages):7.1f} µs/page)')
+  print(f'  new parser:    {new_time:8.4f} sec ({1e6 * new_time / len(pages):7.1f} µs/page)')
+  print(f'  speedup:       {legacy_time / new_time:8.2f}×')
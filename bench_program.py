@@ -0,0 +1,93 @@
+#! /usr/local/bin/python3
+""" Memory and throughput microbenchmark for Program variant records.
+
+    Builds a synthetic ProgramRegistry with (by default) 50,000 variants, and reports the memory it
+    occupies and how fast Program.values() produces output rows from it. For comparison, the same
+    is done for records that have a per-instance __dict__ and a values() that derives field names
+    from the headings on every call, as Program did before it used __slots__.
+"""
+import argparse
+import time
+import tracemalloc
+
+from program import Program, ProgramRegistry, _items
+
+_awards = ['BA', 'BS', 'MA', 'MS ED', 'ADV CRT']
+_institutions = ['qns', 'htr', 'bkl', '331000', '334000']
+
+
+class DictVariantInfo(object):
+  """ A variant record with a per-instance __dict__.
+  """
+  def __init__(self):
+    for field in _items:
+      setattr(self, field, None)
+
+  def __getitem__(self, field):
+    return getattr(self, field)
+
+  def __setitem__(self, field, value):
+    setattr(self, field, value)
+
+
+def legacy_values(program, variant_tuple, headings=Program._headings):
+  fields = [h.lower().replace(' or ', '_').replace(' ', '_') for h in headings]
+  return [program.variants[variant_tuple][field] for field in fields]
+
+
+def build_registry(num_variants, variants_per_program, record_class=None):
+  """ Return a ProgramRegistry with num_variants variants. With a record_class, each variant’s
+      VariantInfo is replaced by an equivalent record_class instance.
+  """
+  registry = ProgramRegistry()
+  for n in range(num_variants):
+    program = registry.program(str(10000 + n // variants_per_program), 'OCUE', 'Day')
+    k = n % variants_per_program
+    variant_tuple = program.new_variant(_awards[k % len(_awards)], f'{n % 5000:04}.00',
+                                        _institutions[k // len(_awards) % len(_institutions)],
+                                        title=f'Program {n // variants_per_program}',
+                                        tap='YES', apts='NO', vvta='NO',
+                                        first_registration_date='1990-01',
+                                        last_registration_action='2019-05',
+                                        certificate_license='', accreditation='')
+    if record_class is not None:
+      record = record_class()
+      for field in _items:
+        record[field] = program.variants[variant_tuple][field]
+      program.variants[variant_tuple] = record
+  return registry
+
+
+def measure(label, num_variants, variants_per_program, record_class, values, repeat):
+  tracemalloc.start()
+  start = time.perf_counter()
+  registry = build_registry(num_variants, variants_per_program, record_class)
+  build_time = time.perf_counter() - start
+  size, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  best = None
+  for i in range(repeat):
+    start = time.perf_counter()
+    for program in registry.values():
+      for variant_tuple in program.variants:
+        values(program, variant_tuple)
+    elapsed = time.perf_counter() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  print(f'{label:8} {size / 1024 / 1024:8.1f} MB {size / num_variants:7.0f} B/variant  '
+        f'build {build_time:6.3f} sec  values() {num_variants / best:12,.0f} rows/sec')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark Program variant records.')
+  parser.add_argument('-n', '--num_variants', type=int, default=50000)
+  parser.add_argument('-p', '--variants_per_program', type=int, default=5)
+  parser.add_argument('-r', '--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  print(f'{args.num_variants:,} variants, {args.variants_per_program} per program')
+  measure('__dict__', args.num_variants, args.variants_per_program, DictVariantInfo,
+          legacy_values, args.repeat)
+  measure('__slots__', args.num_variants, args.variants_per_program, None,
+          Program.values, args.repeat)
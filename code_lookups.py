@@ -0,0 +1,69 @@
+""" Code lookup tables shared by generate_html.py and dgw_info/cuny_requirement_blocks.py.
+
+    Each table is read from the database the first time it is used, and is then kept for the life of
+    the process as a read-only mapping, so importing this module costs nothing, and no caller pays
+    for more than one query per table. Worker processes can be handed their parent’s copy of a table
+    with install(), so they do not query the database at all.
+"""
+from collections import namedtuple
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping
+
+from pgconnection import PgConnection
+
+CUNY_Institution = namedtuple('CUNY_Institution', 'name prompt')
+
+_tables = dict()
+
+
+# _table()
+# -------------------------------------------------------------------------------------------------
+def _table(name, query, value=lambda row: row[1]):
+  """ Return the named table: a read-only dict from the first column of each row of the query
+      result to value(row). The query is run only the first time.
+  """
+  if name not in _tables:
+    conn = PgConnection()
+    cursor = conn.cursor()
+    cursor.execute(query)
+    _tables[name] = MappingProxyType({row[0]: value(row) for row in cursor.fetchall()})
+    conn.close()
+  return _tables[name]
+
+
+# install()
+# -------------------------------------------------------------------------------------------------
+def install(name, table):
+  """ Use table, a copy of what the function called name returned in another process, instead of
+      reading it from the database.
+  """
+  _tables[name] = MappingProxyType(dict(table))
+
+
+# hegis_codes()
+# -------------------------------------------------------------------------------------------------
+def hegis_codes() -> Mapping[str, str]:
+  """ HEGIS code => description, from the hegis_codes table.
+  """
+  return _table('hegis_codes', 'select hegis_code, description from hegis_codes')
+
+
+# cuny_institutions()
+# -------------------------------------------------------------------------------------------------
+def cuny_institutions() -> Mapping[str, CUNY_Institution]:
+  """ CUNYfirst institution code (QNS01, etc.) => (name, prompt), from the cuny_institutions table.
+  """
+  return _table('cuny_institutions', 'select code, name, prompt from cuny_institutions',
+                lambda row: CUNY_Institution(row.name, row.prompt))
+
+
+# cip_title()
+# -------------------------------------------------------------------------------------------------
+@lru_cache(maxsize=4096)
+def cip_title(cip_code: str) -> str:
+  """ The title for a CIP code, from the cipcodes module. The same codes come up for many rows, so
+      each one is looked up just once.
+  """
+  from cipcodes import cip_codes
+  return cip_codes(cip_code)
@@ -0,0 +1,177 @@
+""" Parser for the NYSED program details (IRPSL3) web pages.
+
+    A details page is a PRE block inside an un-closed H4. The lines of interest are:
+
+      * A program line (first token is the program code) followed by optional multi-award (M/A) and
+        multi-institution (M/I) lines. These lines determine the program variants for a program. An
+        M/I line may instead say that an institution is NOT-GRANTING the award of the previous line,
+        in which case variants for that award-institution pair have to be removed.
+      * A FOR AWARD line followed by detail lines (certificate/license, financial aid eligibility,
+        professional accreditation, and registration dates) for that award. There will be one or
+        more for-award groups. The details get applied to all variants that include the award.
+
+    parse_details() makes a single pass over the page, classifying each line by its first token
+    with a two-state machine: until the first FOR AWARD line only variant lines count; after it,
+    detail lines count too. All patterns are compiled once, when the module is imported.
+
+    The result is a list of records, in page order, that does not depend on which institution’s
+    programs are being looked up, so a page can be parsed once and applied to the Program for any
+    number of target institutions.
+"""
+import re
+from collections import namedtuple
+
+# Records returned by parse_details()
+Variant_Line = namedtuple('Variant_Line', 'award hegis institution title')
+Not_Granting = namedtuple('Not_Granting', 'award institutions')
+For_Award = namedtuple('For_Award', 'award')
+Certificate = namedtuple('Certificate', 'cert_info')
+Eligibility = namedtuple('Eligibility', 'tap apts vvta')
+Accreditation = namedtuple('Accreditation', 'accreditation')
+Registration_Dates = namedtuple('Registration_Dates', 'first_date last_date')
+
+# The line boundaries recognized by str.splitlines(), except for \x1e (Record Separator). There was
+# a web page that had a 0x1e in the middle of a string of blanks (program code 31441 at CSI), which
+# broke parsing the program line, so it is deleted from lines instead of separating them.
+_line = re.compile(r'[^\n\r\v\f\x1c\x1d\x85\u2028\u2029]+')
+_wanted = re.compile(r'^\s+\d{5}\s+|FOR AWARD|PROGRAM|CERTIFICATE|M/A|M/I')
+_program = re.compile(r'\s*(\d+|M/A)\s+(.+)(\d{4}\.\d{2})\s+(\S+\s?\S*)\s+(.+)')
+_not_granting = re.compile(r'NOT-GRANTING\s+(.+)')
+_multi_institution = re.compile(r'(\d{4}.\d{2})\s+(\S+\s?\S*)\s+(.*)')
+_for_award = re.compile(r'\s*FOR AWARD\s*--(.*)')
+_white_space = re.compile(r'\s+')
+_eligibility = re.compile(r'(YES|NO).+(YES|NO).+(YES|NO)')
+_dates = re.compile(r'DATE:\s+(\S+).+ACTION:\s+(\S+)')
+
+# Parser states
+_VARIANTS, _DETAILS = range(2)
+
+
+# fix_title()
+# -------------------------------------------------------------------------------------------------
+def fix_title(str):
+  """ Create a better titlecase string, taking specifics of this dataset into account.
+  """
+  return (str.strip(' *')
+             .title()
+             .replace('Cuny', 'CUNY')
+             .replace('Mhc', 'MHC')
+             .replace('Suny', 'SUNY')
+             .replace('\'S', '’s')
+             .replace('1St', '1st')
+             .replace('6Th', '6th')
+             .replace(' And ', ' and ')
+             .replace(' Of ', ' of '))
+
+
+# parse_details()
+# -------------------------------------------------------------------------------------------------
+def parse_details(page, program_code='', ids_by_name=None, encoding='iso-8859-1', debug=False):
+  """ Return the list of records for a details page, which may be str or bytes (decoded using
+      encoding).
+      Institution names are translated to ids using ids_by_name, a dict from name to a list of ids
+      such as knowninstitutions.ids_by_name; a name that is not in the dict is an error. If
+      ids_by_name is None, records contain the institution names as they appear on the page.
+      Raises ValueError for lines that cannot be parsed.
+  """
+  if isinstance(page, bytes):
+    page = page.decode(encoding, errors='replace')
+
+  def institution_ids(name, line):
+    if ids_by_name is None:
+      return [name]
+    try:
+      return ids_by_name[name]
+    except KeyError:
+      raise ValueError(f'Unrecognized institution {name} in {line}') from None
+
+  records = []
+  append = records.append
+  state = _VARIANTS
+  program_award = None
+
+  for match in _line.finditer(page):
+    line = match.group()
+    if '\x1e' in line:
+      line = line.replace('\x1e', '')
+    if _wanted.search(line) is None:
+      continue
+    line = line.replace('<H4><PRE>', '').strip()
+    if debug:
+      print(line)
+    # Use the first token on a line to determine the type of line.
+    tokens = line.split(None, 2)
+    token = tokens[0]
+
+    # Variant lines, in either state.
+    if token.isdecimal() or token == 'M/A':
+      matches = _program.match(line)
+      if matches is None:
+        raise ValueError(f'Unable to parse program code line for program code {program_code}:\n'
+                         f'{line}')
+      program_award = matches.group(4).strip()
+      append(Variant_Line(program_award, matches.group(3),
+                          institution_ids(matches.group(5), line)[0],
+                          fix_title(matches.group(2))))
+      continue
+
+    if token == 'M/I':
+      if 'NOT-GRANTING' in line:
+        matches = _not_granting.search(line)
+        if matches is None:
+          raise ValueError(f'Unable to parse M/I line for program code {program_code}:{line}')
+        name = matches.group(1).strip()
+        if ids_by_name is None:
+          append(Not_Granting(program_award, [name]))
+        else:
+          append(Not_Granting(program_award, ids_by_name.get(name, [])))
+      else:
+        matches = _multi_institution.search(line)
+        if matches is None:
+          raise ValueError(f'Unable to parse M/I line for program code {program_code}:{line}')
+        program_award = matches.group(2).strip()
+        append(Variant_Line(program_award, matches.group(1),
+                            institution_ids(matches.group(3).strip(), line)[0], None))
+      continue
+
+    if token == 'FOR':
+      matches = _for_award.match(line)
+      if matches is None:
+        raise ValueError(f'Unable to parse award line for program code {program_code}:{line}')
+      append(For_Award(matches.group(1).strip()))
+      state = _DETAILS
+      continue
+
+    # Detail lines for the current award.
+    if state != _DETAILS:
+      continue
+
+    if token.startswith('CERTIFICATE'):
+      # Certificate tuple {name, type, date} if there is one.
+      cert_info = _white_space.sub(' ', line.split(':')[1].strip())
+      if cert_info.startswith('NONE'):
+        cert_info = ''
+      append(Certificate(cert_info))
+      continue
+
+    if token != 'PROGRAM' or len(tokens) < 2:
+      continue
+
+    if tokens[1] == 'FINANCIAL':
+      matches = _eligibility.search(line)
+      if matches is None:
+        raise ValueError(f'Unable to parse eligibility line for program code {program_code}:\n'
+                         f'{line}')
+      append(Eligibility(matches.group(1), matches.group(2), matches.group(3)))
+
+    elif tokens[1] == 'PROFESSIONAL':
+      append(Accreditation(line.split(':')[1].strip()))
+
+    elif tokens[1] == 'FIRST':
+      matches = _dates.search(line)
+      if matches is None:
+        raise ValueError(f'Unable to parse registration dates for program code {program_code}:\n'
+                         f'{line}')
+      append(Registration_Dates(matches[1], matches[2]))
+
+  return records
@@ -0,0 +1,86 @@
+#! /usr/local/bin/python3
+""" Compare the speed of decruft() in cuny_requirement_blocks.py with the version it replaced, using
+    the largest requirement blocks in a DegreeWorks DAP_REQ_BLOCK export (csv or xml).
+
+    The old version translated, then did two replaces, then removed everything after the first END.
+    with re.sub(r'[Ee][Nn][Dd]\.(.|\n)*', ...), which steps through the rest of the block one
+    character at a time. Both versions must give the same result for every block.
+"""
+import argparse
+import heapq
+import re
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from cuny_requirement_blocks import decruft, csv_generator, xml_generator
+
+_legacy_trans_dict = dict()
+for c in range(14, 31):
+  _legacy_trans_dict[c] = None
+_legacy_cruft_table = str.maketrans(_legacy_trans_dict)
+
+
+def legacy_decruft(block):
+  return_block = block.translate(_legacy_cruft_table)
+  return_block = return_block.replace('\t', ' ').replace("'", '’')
+  return_block = re.sub(r'[Ee][Nn][Dd]\.(.|\n)*', 'END.\n', return_block)
+  return return_block
+
+
+# largest_blocks()
+# -------------------------------------------------------------------------------------------------
+def largest_blocks(file, num_blocks, delimiter, quotechar):
+  """ The requirement_text of the num_blocks largest blocks in the export, largest first.
+  """
+  if file.suffix.lower() == '.xml':
+    rows = xml_generator(file)
+  else:
+    rows = csv_generator(file, delimiter, quotechar)
+  return heapq.nlargest(num_blocks, (row.requirement_text or '' for row in rows), key=len)
+
+
+# best_time()
+# -------------------------------------------------------------------------------------------------
+def best_time(function, blocks, repeat):
+  """ Best of repeat runs of function over all blocks, in seconds.
+  """
+  best = None
+  for i in range(repeat):
+    start = time.perf_counter()
+    for block in blocks:
+      function(block)
+    elapsed = time.perf_counter() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark decruft() on the largest blocks of an '
+                                               'export.')
+  parser.add_argument('file', nargs='?', default='./downloads/dgw_dap_req_block.csv')
+  parser.add_argument('-n', '--num_blocks', type=int, default=100)
+  parser.add_argument('-r', '--repeat', type=int, default=5)
+  parser.add_argument('-de', '--delimiter', default=',')
+  parser.add_argument('-q', '--quotechar', default='"')
+  args = parser.parse_args()
+
+  blocks = largest_blocks(Path(args.file), args.num_blocks, args.delimiter, args.quotechar)
+  if len(blocks) == 0:
+    sys.exit(f'No requirement blocks in {args.file}')
+
+  for block in blocks:
+    assert decruft(block) == legacy_decruft(block), 'Versions disagree'
+
+  num_chars = sum(len(block) for block in blocks)
+  legacy_time = best_time(legacy_decruft, blocks, args.repeat)
+  new_time = best_time(decruft, blocks, args.repeat)
+  print(f'{len(blocks):,} largest blocks ({len(blocks[-1]):,} to {len(blocks[0]):,} characters, '
+        f'{num_chars:,} total); best of {args.repeat} runs')
+  print(f'  legacy decruft: {legacy_time:8.4f} sec '
+        f'({1e6 * legacy_time / len(blocks):9.1f} µs/block)')
+  print(f'  new decruft:    {new_time:8.4f} sec ({1e6 * new_time / len(blocks):9.1f} µs/block)')
+  print(f'  speedup:        {legacy_time / new_time:8.2f}×')
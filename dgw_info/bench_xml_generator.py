@@ -0,0 +1,114 @@
+#! /usr/local/bin/python3
+""" Peak memory (RSS) used to read DegreeWorks DAP_REQ_BLOCK xml exports of increasing size, using
+    xml_generator() from cuny_requirement_blocks.py and, for comparison, the ElementTree.parse()
+    reader it replaced.
+
+    Each measurement is made in a fresh process that reads every row of a synthetic export with
+    requirement_text CLOBs of the given size. With the streaming reader, peak RSS should be about
+    the same for every export size; with the tree reader, it grows with the size of the export.
+"""
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+
+from collections import namedtuple
+from pathlib import Path
+from xml.etree.ElementTree import parse
+from xml.sax.saxutils import escape
+
+_columns = ['INSTITUTION', 'REQUIREMENT_ID', 'BLOCK_TYPE', 'BLOCK_VALUE', 'TITLE', 'PERIOD_START',
+            'PERIOD_STOP', 'SCHOOL', 'DEGREE', 'COLLEGE', 'MAJOR1', 'MAJOR2', 'CONCENTRATION',
+            'MINOR', 'LIBERAL_LEARNING', 'SPECIALIZATION', 'PROGRAM', 'STUDENT_ID',
+            'REQUIREMENT_TEXT', 'IRDW_LOAD_DATE']
+
+
+# write_export()
+# -------------------------------------------------------------------------------------------------
+def write_export(path, num_rows, clob_size):
+  """ Write a synthetic export with num_rows rows, each with a requirement_text of about clob_size
+      characters.
+  """
+  line = 'BEGIN 120 CREDITS IN @ (WITH DWRESIDENT=Y) # Requirement line <with> markup\n'
+  clob = escape(line * (clob_size // len(line) + 1))
+  with open(path, 'w') as export:
+    export.write('<?xml version="1.0"?>\n<ROWSET>\n')
+    for n in range(num_rows):
+      values = ['QNS01', f'RA{n:06}', 'MAJOR', f'PLAN{n}-BA', f'Block {n}', '2019-2020U',
+                '99999999', 'U', 'BA', '01', '', '', '', '', '', '', '', '', clob,
+                '2020-01-15 00:00:00']
+      export.write('<ROW>')
+      for column, value in zip(_columns, values):
+        export.write(f'<COLUMN NAME="{column}">{value}</COLUMN>')
+      export.write('</ROW>\n')
+    export.write('</ROWSET>\n')
+
+
+# tree_generator()
+# -------------------------------------------------------------------------------------------------
+def tree_generator(file):
+  """ The reader xml_generator() replaced: parse the whole file, then generate rows from the tree.
+  """
+  tree = parse(file)
+  Row = None
+  for record in tree.findall("ROW"):
+    cols = record.findall('COLUMN')
+    line = [col.text for col in cols]
+    if Row is None:
+      Row = namedtuple('Row', [col.attrib['NAME'].lower() for col in cols])
+    yield Row._make(line)
+
+
+# peak_rss()
+# -------------------------------------------------------------------------------------------------
+def peak_rss():
+  """ Peak resident set size of this process, in MB.
+  """
+  max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == 'darwin':
+    return max_rss / 1024 / 1024  # bytes
+  return max_rss / 1024           # kilobytes
+
+
+# measure()
+# -------------------------------------------------------------------------------------------------
+def measure(reader, path):
+  """ Read all rows of path with reader in a fresh process; return (num_rows, peak RSS in MB).
+  """
+  result = subprocess.run([sys.executable, __file__, '--child', reader, str(path)],
+                          check=True, capture_output=True, text=True)
+  num_rows, rss = result.stdout.split()
+  return int(num_rows), float(rss)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark peak memory of reading xml exports.')
+  parser.add_argument('-r', '--rows', type=int, nargs='+', default=[500, 2000, 8000])
+  parser.add_argument('-c', '--clob_size', type=int, default=20000)
+  parser.add_argument('--child', nargs=2, metavar=('READER', 'FILE'), help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    # Both readers are measured with cuny_requirement_blocks imported, so they start out the same.
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from cuny_requirement_blocks import xml_generator
+    reader, file = args.child
+    generator = xml_generator if reader == 'iterparse' else tree_generator
+    num_rows = 0
+    for row in generator(file):
+      num_rows += 1
+    print(num_rows, f'{peak_rss():.1f}')
+    exit(0)
+
+  with tempfile.TemporaryDirectory() as temp_dir:
+    print(f'{"rows":>8} {"file MB":>9} {"parse() MB":>11} {"iterparse() MB":>15}')
+    for num_rows in args.rows:
+      path = Path(temp_dir, f'export_{num_rows}.xml')
+      write_export(path, num_rows, args.clob_size)
+      tree_rows, tree_rss = measure('parse', path)
+      stream_rows, stream_rss = measure('iterparse', path)
+      assert tree_rows == stream_rows == num_rows, 'Readers disagree'
+      print(f'{num_rows:8,} {path.stat().st_size / 1024 / 1024:9.1f} {tree_rss:11.1f} '
+            f'{stream_rss:15.1f}')
+      path.unlink()
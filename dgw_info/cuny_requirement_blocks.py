@@ -43,32 +43,45 @@
 import re
 import sys
 import csv
+import time
+import inspect
 import argparse
 
+from hashlib import sha1
 from pathlib import Path
 from datetime import datetime, timezone
 from collections import namedtuple
-from xml.etree.ElementTree import parse
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree.ElementTree import iterparse, ParseError
 
 from pgconnection import PgConnection
 
 from dgw_filter import dgw_filter
+from memo_cache import MemoCache
 
-# Dict of known institution names
-conn = PgConnection()
-cursor = conn.cursor()
-cursor.execute('select code, name from cuny_institutions')
-institution_names = {row.code: row.name for row in cursor.fetchall()}
-conn.close()
+# The code lookup tables and COPY helpers shared with the registered programs scripts are in the
+# parent directory. It goes at the end of the path so that it does not shadow modules on PYTHONPATH
+# with the parent directory’s scripts, some of which do their work when imported.
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import code_lookups
+from pgcopy import copy_line, copy_rows
 
 csv.field_size_limit(sys.maxsize)
 
+# Translation table for decruft(): delete chars 0x0e through 0x1e, and change tabs to spaces.
+# (Primes are not changed to u2019 here: mapping to a non-ASCII character would take
+# str.translate() off its fast path for ASCII text.)
 trans_dict = dict()
 for c in range(14, 31):
   trans_dict[c] = None
+trans_dict[ord('\t')] = ' '
 
 cruft_table = str.maketrans(trans_dict)
 
+# decruft() ignores everything following the first END.
+end_pattern = re.compile(r'[Ee][Nn][Dd]\.')
+
 
 # decruft()
 # -------------------------------------------------------------------------------------------------
@@ -78,16 +91,17 @@ def decruft(block):
       files. But for csv files where strip_files wasn't run, this makes the text cleaner, avoiding
       possible parsing problems.
   """
+  # Remove the cruft and replace tabs with spaces, in one pass.
   return_block = block.translate(cruft_table)
 
-  # Replace tabs with spaces, and primes with u2018.
-  return_block = return_block.replace('\t', ' ').replace("'", '’')
-
   # Remove all text following END. that needs/wants never to be seen, and which messes up parsing
-  # anyway.
-  return_block = re.sub(r'[Ee][Nn][Dd]\.(.|\n)*', 'END.\n', return_block)
+  # anyway. The search stops at the first END., and the text before it is kept with a slice.
+  match = end_pattern.search(return_block)
+  if match is not None:
+    return_block = return_block[:match.start()] + 'END.\n'
 
-  return return_block
+  # Replace primes with u2019 in what is left.
+  return return_block.replace("'", '’')
 
 
 # catalog_years()
@@ -141,7 +155,7 @@ def to_html(row, with_line_nums=False):
 
   catalog_type, first_year, last_year, catalog_years_text = catalog_years(row.period_start,
                                                                           row.period_stop)
-  institution_name = institution_names[row.institution]
+  institution_name = code_lookups.cuny_institutions()[row.institution].name
   requirement_text = dgw_filter(row.requirement_text)
   html = f"""
 
@@ -165,14 +179,14 @@ def to_html(row, with_line_nums=False):
 
 # csv_generator()
 # -------------------------------------------------------------------------------------------------
-def csv_generator(file):
+def csv_generator(file, delimiter=',', quotechar='"'):
   """ Generate rows from a csv export of OIRA’s DAP_REQ_BLOCK table.
   """
   cols = None
   with open(file, newline='') as query_file:
     reader = csv.reader(query_file,
-                        delimiter=args.delimiter,
-                        quotechar=args.quotechar)
+                        delimiter=delimiter,
+                        quotechar=quotechar)
     for line in reader:
       if cols is None:
         cols = [col.lower().replace(' ', '_') for col in line]
@@ -189,34 +203,37 @@ def csv_generator(file):
 # -------------------------------------------------------------------------------------------------
 def xml_generator(file):
   """ Generate rows from an xml export of OIRA’s DAP_REQ_BLOCK table.
+      The file is read incrementally: each ROW element (child of the root element) is turned into a
+      Row as soon as its end tag has been read, and is then discarded, so memory use does not grow
+      with the size of the file.
   """
+  Row = None
+  depth = 0
+  root = None
   try:
-    tree = parse(file)
-  except xml.etree.ElementTree.ParseError as pe:
+    for event, element in iterparse(file, events=('start', 'end')):
+      if event == 'start':
+        if root is None:
+          root = element
+        depth += 1
+        continue
+      depth -= 1
+      if depth != 1 or element.tag != 'ROW':
+        continue
+      cols = element.findall('COLUMN')
+      line = [col.text for col in cols]
+      if Row is None:
+        Row = namedtuple('Row', [col.attrib['NAME'].lower() for col in cols])
+      row = Row._make(line)
+      # Drop the rows processed so far (only the current one, in practice) from the tree.
+      root.clear()
+      yield row
+  except ParseError as pe:
     sys.exit(pe)
 
-  Row = None
-  for record in tree.findall("ROW"):
-    cols = record.findall('COLUMN')
-    line = [col.text for col in cols]
-    if Row is None:
-      # array = [col.attrib['NAME'].lower() for col in cols]
-      Row = namedtuple('Row', [col.attrib['NAME'].lower() for col in cols])
-    row = Row._make(line)
-    yield row
-
 
-# __main__()
-# -------------------------------------------------------------------------------------------------
-parser = argparse.ArgumentParser()
-parser.add_argument('-d', '--debug', action='store_true', default=False)
-parser.add_argument('-v', '--verbose', action='store_true', default=False)
-parser.add_argument('-f', '--file', default='./downloads/dgw_dap_req_block.csv')
-parser.add_argument('-de', '--delimiter', default=',')
-parser.add_argument('-q', '--quotechar', default='"')
-args = parser.parse_args()
-
-# These are the columns that get initialized here. See cursor.create table for full list of columns.
+# These are the columns that get initialized here. See cursor.create table for full list of
+# columns.
 db_cols = ['institution',
            'requirement_id',
            'block_type',
@@ -237,153 +254,402 @@ db_cols = ['institution',
            'student_id',
            'requirement_text',
            'requirement_html']
-vals = '%s, ' * len(db_cols)
-vals = '(' + vals.strip(', ') + ')'
 
 DB_Record = namedtuple('DB_Record', db_cols)
 
-conn = PgConnection()
-cursor = conn.cursor()
-
-# Dict of rows by institution
-institutions = {}
-Institution = namedtuple('Institution', 'load_date rows')
-
-file = Path(args.file)
-if not file.exists():
-  # Try the latest archived version
-  archives_dir = Path('/Users/vickery/CUNY_Programs/dgw_info/archives')
-  archives = archives_dir.glob('dgw_dap_req_block*.csv')
-  latest = None
-  for archive in archives:
-    if latest is None or archive.stat().st_mtime > latest.stat().st_mtime:
-      latest = archive
-  if latest is None:
-    sys.exit(f'{file} does not exist, and no archive found')
-  file = latest
-
-if file.suffix.lower() == '.xml':
-  generator = xml_generator
-elif file.suffix.lower() == '.csv':
-  generator = csv_generator
-else:
-  sys.exit(f'Unsupported file type: {file.suffix}')
-
-# Gather all the rows for all the institutions
-for row in generator(file):
-  institution = row.institution.upper()
-
-  # Integrity check: all rows for an institution must have the same load date.
-  load_date = row.irdw_load_date[0:10]
-  if institution not in institutions.keys():
-    institutions[institution] = Institution._make([load_date, []])
-  assert load_date == institutions[institution].load_date, \
-      f'{load_date} is not {institutions[institution].load_date} for {institution}'
-
-  institutions[institution].rows.append(row)
-
-# Recreate the requirement_blocks table
-cursor.execute("""drop table if exists requirement_blocks cascade;
-                  create table requirement_blocks (
-                  institution text,
-                  requirement_id text,
-                  block_type text,
-                  block_value text,
-                  title text,
-                  period_start text,
-                  period_stop text,
-                  school text,
-                  degree text,
-                  college text,
-                  major1 text,
-                  major2 text,
-                  concentration text,
-                  minor text,
-                  liberal_learning text,
-                  specialization text,
-                  program text,
-                  student_id text,
-                  requirement_text text,
-                  requirement_html text default 'Not Available',
-                  header_list jsonb default '[]'::jsonb,
-                  body_list jsonb default '[]'::jsonb,
-                  primary key (institution, requirement_id))""")
-
-# Add the view, which omits the requirement_text, requirement_html, and object lists.
-cursor.execute("""
-drop view if exists view_requirement_blocks;
-create view view_requirement_blocks as (
-  select  institution,
-           requirement_id,
-           block_type,
-           block_value,
-           title,
-           period_start,
-           period_stop,
-           school,
-           degree,
-           college,
-           major1,
-           major2,
-           concentration,
-           minor,
-           liberal_learning,
-           specialization,
-           program
-  from requirement_blocks
-  order by institution, requirement_id, block_type, block_value, period_stop);
-""")
-
-# Process the rows from the csv or xml file, institution by institution
-for institution in institutions.keys():
-  load_date = institutions[institution].load_date
+
+# load_date_of()
+# -------------------------------------------------------------------------------------------------
+def load_date_of(irdw_load_date):
+  """ Return an export row’s load date as YYYY-MM-DD. Exits if the date is in an unrecognized
+      format.
+  """
+  load_date = irdw_load_date[0:10]
   # Desired date format: YYYY-MM-DD
   if re.match(r'^\d{4}-\d{2}-\d{2}$', load_date):
-    pass
+    return load_date
   # Alternate format: DD-MMM-YY
-  elif re.match(r'\d{2}-[a-z]{3}-\d{2}', load_date, re.I):
-    load_date = datetime.strptime(load_date, '%d-%b-%y').strftime('%Y-%m-%d')
+  if re.match(r'\d{2}-[a-z]{3}-\d{2}', load_date, re.I):
+    return datetime.strptime(load_date, '%d-%b-%y').strftime('%Y-%m-%d')
+  sys.exit(f'Unrecognized load date format: {load_date}')
+
+
+# render_version()
+# -------------------------------------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def render_version():
+  """ A hash of the code that the records made from export rows depend on: db_record(), decruft()
+      and its tables, to_html(), catalog_years(), and the dgw_filter module.
+  """
+  sources = [repr(cruft_table), end_pattern.pattern]
+  for code in (db_record, decruft, to_html, catalog_years, sys.modules[dgw_filter.__module__]):
+    try:
+      sources.append(inspect.getsource(code))
+    except (OSError, TypeError):
+      sources.append(getattr(code, '__name__', ''))
+  return sha1('\n'.join(sources).encode('utf-8')).hexdigest()
+
+
+# text_hash()
+# -------------------------------------------------------------------------------------------------
+def text_hash(row):
+  """ SHA-1 of an export row’s requirement_text. The text is by far the largest part of a row, so
+      it is hashed just once, and this digest stands in for it in the html_key() and the
+      source_hash().
+  """
+  return sha1(row.requirement_text.encode('utf-8')).hexdigest()
+
+
+# html_key()
+# -------------------------------------------------------------------------------------------------
+def html_key(row, row_text_hash):
+  """ The memo cache key for to_html(row): a hash of the render_version() and of the export
+      columns and institution name that the html is made from, with the requirement_text given by
+      its text_hash().
+  """
+  institution_name = code_lookups.cuny_institutions()[row.institution].name
+  values = [render_version(), row.institution, institution_name, row.requirement_id,
+            row_text_hash, row.title, row.period_start, row.period_stop]
+  return sha1(copy_line(values).encode('utf-8')).hexdigest()
+
+
+# db_record()
+# -------------------------------------------------------------------------------------------------
+def db_record(institution, row, requirement_html=None):
+  """ The requirement_blocks record for an export row: the row’s columns, with the title and
+      requirement_text decrufted, plus the requirement_html, which is rendered unless it is given.
+  """
+  if requirement_html is None:
+    requirement_html = to_html(row)
+  return DB_Record._make([institution,
+                          row.requirement_id,
+                          row.block_type,
+                          row.block_value,
+                          decruft(row.title),
+                          row.period_start,
+                          row.period_stop,
+                          row.school,
+                          row.degree,
+                          row.college,
+                          row.major1,
+                          row.major2,
+                          row.concentration,
+                          row.minor,
+                          row.liberal_learning,
+                          row.specialization,
+                          row.program,
+                          row.student_id,
+                          decruft(row.requirement_text),
+                          requirement_html])
+
+
+# Worker processes get export rows as plain tuples, and make Rows from them with the column names
+# they were initialized with.
+_Worker_Row = None
+
+
+def _init_worker(cols, cuny_institutions):
+  global _Worker_Row
+  _Worker_Row = namedtuple('Row', cols)
+  code_lookups.install('cuny_institutions', cuny_institutions)
+
+
+def _worker_db_record(institution_values_html):
+  institution, values, requirement_html = institution_values_html
+  return db_record(institution, _Worker_Row._make(values), requirement_html)
+
+
+# db_records()
+# -------------------------------------------------------------------------------------------------
+def db_records(batch, executor=None, jobs=1, memo=None, keys=None):
+  """ Return the list of DB_Records for a batch of (institution, row) pairs, in batch order. With
+      an executor (a process pool that was initialized with _init_worker), the batch is divided
+      into chunks of consecutive rows that are transformed by jobs worker processes.
+      With a MemoCache and the html_key() of each row, html that was rendered for the same inputs
+      before is taken from the cache instead of being rendered again, and newly rendered html is
+      added to it. The cache is used only in this process.
+  """
+  if memo is None:
+    htmls = [None] * len(batch)
+  else:
+    htmls = [memo.get(key) for key in keys]
+
+  if executor is None:
+    records = [db_record(institution, row, requirement_html)
+               for (institution, row), requirement_html in zip(batch, htmls)]
+  else:
+    chunksize = max(1, len(batch) // (4 * jobs))
+    records = list(executor.map(_worker_db_record,
+                                [(institution, tuple(row), requirement_html)
+                                 for (institution, row), requirement_html in zip(batch, htmls)],
+                                chunksize=chunksize))
+
+  if memo is not None:
+    for key, requirement_html, record in zip(keys, htmls, records):
+      if requirement_html is None:
+        memo.put(key, record.requirement_html)
+  return records
+
+
+# source_hash()
+# -------------------------------------------------------------------------------------------------
+def source_hash(institution, row, row_text_hash):
+  """ SHA-1 of the render_version() and of what a block’s record is made from: the export columns
+      and the institution name, as serialized for COPY, with the requirement_text given by its
+      text_hash().
+  """
+  institution_name = code_lookups.cuny_institutions()[row.institution].name
+  values = ([render_version(), institution, institution_name]
+            + [getattr(row, col) for col in db_cols[1:-2]] + [row_text_hash])
+  return sha1(copy_line(values).encode('utf-8')).hexdigest()
+
+
+# copy_records()
+# -------------------------------------------------------------------------------------------------
+def copy_records(cursor, table, db_records, source_hashes):
+  """ Load a batch of DB_Records, with their source hashes, into table with a single COPY.
+  """
+  copy_rows(cursor, table, db_cols + ['source_hash'],
+            (db_record + (source_hash, ) for db_record, source_hash in zip(db_records,
+                                                                          source_hashes)))
+
+
+# __main__()
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-d', '--debug', action='store_true', default=False)
+  parser.add_argument('-v', '--verbose', action='store_true', default=False)
+  parser.add_argument('-f', '--file', default='./downloads/dgw_dap_req_block.csv')
+  parser.add_argument('-de', '--delimiter', default=',')
+  parser.add_argument('-q', '--quotechar', default='"')
+  parser.add_argument('-b', '--batch-size', type=int, default=1000,
+                      help='number of blocks to hold in memory between inserts (default 1000)')
+  parser.add_argument('-j', '--jobs', type=int, default=1,
+                      help='number of processes to decruft and render blocks with (default 1)')
+  parser.add_argument('-i', '--incremental', action='store_true', default=False,
+                      help='change only the blocks that are new, changed, or gone since the last '
+                           'load, instead of rebuilding the table')
+  parser.add_argument('-m', '--memo', default=Path(__file__).resolve().parent / 'html_memo.sqlite3',
+                      help='file for saving rendered requirement html between runs')
+  parser.add_argument('--memo-size', type=float, default=500,
+                      help='maximum MB of html to keep in the memo file (default 500)')
+  parser.add_argument('--no-memo', action='store_true', default=False,
+                      help='render all requirement html, without using the memo file')
+  args = parser.parse_args()
+
+  if args.no_memo:
+    memo = None
   else:
-    sys.exit(f'Unrecognized load date format: {load_date}')
-
-  num_records = len(institutions[institution].rows)
-  suffix = '' if num_records == 1 else 's'
-  if args.verbose:
-    print(f'Inserting {num_records:,} record{suffix} dated {load_date} '
-          f'from {file} for {institution}')
-
-  # Insert the csv rows into the db after decrufting the requirement_text.
-  for row in institutions[institution].rows:
-    db_record = DB_Record._make([institution,
-                                 row.requirement_id,
-                                 row.block_type,
-                                 row.block_value,
-                                 decruft(row.title),
-                                 row.period_start,
-                                 row.period_stop,
-                                 row.school,
-                                 row.degree,
-                                 row.college,
-                                 row.major1,
-                                 row.major2,
-                                 row.concentration,
-                                 row.minor,
-                                 row.liberal_learning,
-                                 row.specialization,
-                                 row.program,
-                                 row.student_id,
-                                 decruft(row.requirement_text),
-                                 to_html(row)])
-
-    vals = ', '.join([f"'{val}'" for val in db_record])
-    cursor.execute(f'insert into requirement_blocks values ({vals})')
-cursor.execute(f"""update updates
-                      set update_date = '{load_date}'
-                    where table_name = 'requirement_blocks'""")
-conn.commit()
-conn.close()
-
-# Archive the file just processed, unless it's already there
-if file.parent.name != 'archives':
-  file.rename(f'/Users/vickery/CUNY_Programs/dgw_info/archives/'
-              f'{file.stem}_{load_date}{file.suffix}')
+    memo = MemoCache(args.memo, int(args.memo_size * 1024 * 1024))
+
+  conn = PgConnection()
+  cursor = conn.cursor()
+
+  file = Path(args.file)
+  if not file.exists():
+    # Try the latest archived version
+    archives_dir = Path('/Users/vickery/CUNY_Programs/dgw_info/archives')
+    archives = archives_dir.glob('dgw_dap_req_block*.csv')
+    latest = None
+    for archive in archives:
+      if latest is None or archive.stat().st_mtime > latest.stat().st_mtime:
+        latest = archive
+    if latest is None:
+      sys.exit(f'{file} does not exist, and no archive found')
+    file = latest
+
+  if file.suffix.lower() == '.xml':
+    rows = xml_generator(file)
+  elif file.suffix.lower() == '.csv':
+    rows = csv_generator(file, args.delimiter, args.quotechar)
+  else:
+    sys.exit(f'Unsupported file type: {file.suffix}')
+
+  # In incremental mode, the source hashes of the blocks loaded last time are compared with those
+  # of the rows in the file, and only the differences are applied to the table. Without a table
+  # that has source hashes, the table is rebuilt.
+  stored_hashes = None
+  if args.incremental:
+    cursor.execute("""select 1 from information_schema.columns
+                       where table_name = 'requirement_blocks'
+                         and column_name = 'source_hash'""")
+    if cursor.rowcount > 0:
+      cursor.execute('select institution, requirement_id, source_hash from requirement_blocks')
+      stored_hashes = {(row.institution, row.requirement_id): row.source_hash
+                       for row in cursor.fetchall()}
+    else:
+      print('No source hashes in requirement_blocks: rebuilding the table.')
+
+  if stored_hashes is None:
+    table = 'requirement_blocks'
+    # Recreate the requirement_blocks table
+    cursor.execute("""drop table if exists requirement_blocks cascade;
+                      create table requirement_blocks (
+                      institution text,
+                      requirement_id text,
+                      block_type text,
+                      block_value text,
+                      title text,
+                      period_start text,
+                      period_stop text,
+                      school text,
+                      degree text,
+                      college text,
+                      major1 text,
+                      major2 text,
+                      concentration text,
+                      minor text,
+                      liberal_learning text,
+                      specialization text,
+                      program text,
+                      student_id text,
+                      requirement_text text,
+                      requirement_html text default 'Not Available',
+                      source_hash text default '',
+                      header_list jsonb default '[]'::jsonb,
+                      body_list jsonb default '[]'::jsonb,
+                      primary key (institution, requirement_id))""")
+
+    # Add the view, which omits the requirement_text, requirement_html, and object lists.
+    cursor.execute("""
+    drop view if exists view_requirement_blocks;
+    create view view_requirement_blocks as (
+      select  institution,
+               requirement_id,
+               block_type,
+               block_value,
+               title,
+               period_start,
+               period_stop,
+               school,
+               degree,
+               college,
+               major1,
+               major2,
+               concentration,
+               minor,
+               liberal_learning,
+               specialization,
+               program
+      from requirement_blocks
+      order by institution, requirement_id, block_type, block_value, period_stop);
+    """)
+  else:
+    # New and changed blocks are COPYed into a temporary table, and merged at the end.
+    table = 'changed_blocks'
+    cursor.execute("""create temporary table changed_blocks
+                        (like requirement_blocks including defaults) on commit drop""")
+    seen = set()
+    num_new = num_changed = 0
+
+  # Process the rows from the csv or xml file as they are read. Blocks are decrufted, rendered, and
+  # COPYed batch_size at a time, so memory use depends on the batch size, not on the size of the
+  # file. A batch holds blocks for just one institution, so the time spent reading, transforming,
+  # and loading each institution’s blocks can be reported. Nothing is committed unless every row
+  # has been processed.
+  # Integrity check: all rows for an institution must have the same load date. The raw date of each
+  # institution’s first row is kept for checking the others against.
+  Institution = namedtuple('Institution', 'raw_load_date load_date num_records seconds')
+  institutions = {}
+  batch = []
+  batch_hashes = []
+  batch_keys = []
+  batch_institution = None
+  batch_start = time.perf_counter()
+  executor = None
+  for row in rows:
+    institution = row.institution.upper()
+    if args.jobs > 1 and executor is None:
+      executor = ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker,
+                                     initargs=(row._fields, dict(code_lookups.cuny_institutions())))
+    if batch_institution is not None and (institution != batch_institution or
+                                          len(batch) >= args.batch_size):
+      if batch:
+        copy_records(cursor, table, db_records(batch, executor, args.jobs, memo, batch_keys),
+                     batch_hashes)
+      institutions[batch_institution] = institutions[batch_institution]._replace(
+          seconds=institutions[batch_institution].seconds + time.perf_counter() - batch_start)
+      batch = []
+      batch_hashes = []
+      batch_keys = []
+      batch_start = time.perf_counter()
+    batch_institution = institution
+
+    raw_load_date = row.irdw_load_date[0:10]
+    if institution not in institutions.keys():
+      institutions[institution] = Institution(raw_load_date, load_date_of(raw_load_date), 0, 0.0)
+    assert raw_load_date == institutions[institution].raw_load_date, \
+        f'{raw_load_date} is not {institutions[institution].raw_load_date} for {institution}'
+    institutions[institution] = institutions[institution]._replace(
+        num_records=institutions[institution].num_records + 1)
+
+    row_text_hash = text_hash(row)
+    row_hash = source_hash(institution, row, row_text_hash)
+    if stored_hashes is not None:
+      key = (institution, row.requirement_id)
+      seen.add(key)
+      if key not in stored_hashes:
+        num_new += 1
+      elif stored_hashes[key] != row_hash:
+        num_changed += 1
+      else:
+        continue
+    batch.append((institution, row))
+    batch_hashes.append(row_hash)
+    if memo is not None:
+      batch_keys.append(html_key(row, row_text_hash))
+  if batch_institution is not None:
+    if batch:
+      copy_records(cursor, table, db_records(batch, executor, args.jobs, memo, batch_keys),
+                   batch_hashes)
+    institutions[batch_institution] = institutions[batch_institution]._replace(
+        seconds=institutions[batch_institution].seconds + time.perf_counter() - batch_start)
+
+  if executor is not None:
+    executor.shutdown()
+  if memo is not None:
+    memo.close()
+    if args.verbose:
+      print(f'html memo: {memo.hits:,} hits, {memo.misses:,} misses')
+
+  verb = 'Checked' if stored_hashes is not None else 'Loaded'
+  for institution, info in institutions.items():
+    load_date = info.load_date
+    suffix = '' if info.num_records == 1 else 's'
+    print(f'{verb} {info.num_records:,} record{suffix} dated {load_date} from {file} for '
+          f'{institution} in {info.seconds:.3f} sec ({info.num_records / info.seconds:,.0f} '
+          f'rows/sec).')
+
+  if stored_hashes is not None:
+    # Insert the new blocks and replace the changed ones, whose header and body lists have to be
+    # parsed again. Unchanged blocks keep theirs.
+    columns = ', '.join(db_cols + ['source_hash'])
+    updates = ', '.join(f'{col} = excluded.{col}' for col in db_cols[2:] + ['source_hash'])
+    cursor.execute(f"""insert into requirement_blocks ({columns})
+                       select {columns} from changed_blocks
+                       on conflict (institution, requirement_id) do update
+                       set {updates}, header_list = default, body_list = default""")
+    # Delete blocks that are no longer in the export.
+    gone = [key for key in stored_hashes if key not in seen]
+    if gone:
+      cursor.execute("""create temporary table gone_blocks (institution text, requirement_id text)
+                        on commit drop""")
+      copy_rows(cursor, 'gone_blocks', ['institution', 'requirement_id'], gone)
+      cursor.execute("""delete from requirement_blocks r
+                         using gone_blocks g
+                         where r.institution = g.institution
+                           and r.requirement_id = g.requirement_id""")
+    print(f'{num_new:,} new, {num_changed:,} changed, {len(seen) - num_new - num_changed:,} '
+          f'unchanged, and {len(gone):,} deleted blocks.')
+
+  cursor.execute("""update updates
+                       set update_date = %s
+                     where table_name = 'requirement_blocks'""", (load_date, ))
+  conn.commit()
+  conn.close()
+
+  # Archive the file just processed, unless it's already there
+  if file.parent.name != 'archives':
+    file.rename(f'/Users/vickery/CUNY_Programs/dgw_info/archives/'
+                f'{file.stem}_{load_date}{file.suffix}')
@@ -0,0 +1,66 @@
+""" A persistent, size-bounded memo cache, kept in a SQLite file.
+
+    Values are strings, stored by key (normally a hash of everything the value was computed from).
+    Each entry records when it was last used; when the total size of the values is over the limit
+    at close(), the least recently used entries are evicted until it is not. The numbers of hits
+    and misses since the cache was opened are kept in hits and misses.
+"""
+import sqlite3
+import time
+
+
+class MemoCache(object):
+  """ Memo cache in the SQLite file at path, holding up to max_bytes of values.
+  """
+  def __init__(self, path, max_bytes=500 * 1024 * 1024):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self._conn = sqlite3.connect(str(path))
+    self._conn.execute("""create table if not exists memo (
+                            key text primary key,
+                            value text,
+                            size integer,
+                            used real)""")
+    self._conn.execute('create index if not exists memo_used on memo (used)')
+
+  def get(self, key):
+    """ Return the value for key, or None if there is none.
+    """
+    row = self._conn.execute('select value from memo where key = ?', (key, )).fetchone()
+    if row is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self._conn.execute('update memo set used = ? where key = ?', (time.time(), key))
+    return row[0]
+
+  def put(self, key, value):
+    """ Save the value for key.
+    """
+    self._conn.execute('insert or replace into memo values (?, ?, ?, ?)',
+                       (key, value, len(value), time.time()))
+
+  def evict(self):
+    """ Delete least recently used entries until the values fit in max_bytes; return the number
+        of entries deleted.
+    """
+    total = self._conn.execute('select coalesce(sum(size), 0) from memo').fetchone()[0]
+    if total <= self.max_bytes:
+      return 0
+    keys = []
+    for key, size in self._conn.execute('select key, size from memo order by used'):
+      keys.append((key, ))
+      total -= size
+      if total <= self.max_bytes:
+        break
+    self._conn.executemany('delete from memo where key = ?', keys)
+    return len(keys)
+
+  def close(self):
+    """ Evict entries if necessary, and save the cache.
+    """
+    self.evict()
+    self._conn.commit()
+    self._conn.close()
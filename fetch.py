@@ -0,0 +1,246 @@
+""" Shared HTTP layer for the scripts that scrape the NYSED website.
+
+    All requests go through a single keep-alive requests.Session, so a run that makes hundreds of
+    requests to www.nysed.gov reuses a few TCP connections instead of opening one per request.
+
+    Each request has a timeout, and requests that fail because of a dropped connection, a timeout,
+    or a server-side (5xx or 429) response are retried with exponential backoff plus random jitter.
+    Only when all retries fail does the error reach the caller, which is where the scripts decide
+    whether to notify someone and give up.
+
+    Requests are also spaced so that, across all threads, no more than requests_per_second of them
+    are started per second.
+
+    Optionally, successful responses are cached on disk in cache_dir, keyed by a hash of the method,
+    URL, and form data. A cached response younger than max_age seconds is returned without touching
+    the network; an older one is revalidated with If-None-Match/If-Modified-Since when the server
+    supplied an ETag or Last-Modified header, and re-fetched otherwise. The least-recently used
+    entries are evicted when the cache grows beyond max_cache_size bytes.
+"""
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Defaults; change them with configure().
+timeout = 30.0              # Seconds to wait for the server to connect or send data.
+max_retries = 5             # Retries after the first attempt, so six attempts in all.
+backoff = 1.0               # Seconds before the first retry; doubled for each one after that.
+requests_per_second = 5.0   # Ceiling on the rate at which requests are started.
+pool_size = 10              # Connections kept alive per host; should be at least the thread count.
+cache_dir = None            # Directory for cached responses; None disables the cache.
+max_age = 0.0               # Seconds a cached response is used without revalidation.
+max_cache_size = 500 * 1024 * 1024  # Bytes of cached response bodies to keep.
+
+_settings = ('timeout', 'max_retries', 'backoff', 'requests_per_second', 'pool_size',
+             'cache_dir', 'max_age', 'max_cache_size')
+_retry_status_codes = (429, 500, 502, 503, 504)
+_session = None
+_lock = threading.Lock()
+_cache_lock = threading.Lock()
+_cache_bytes = None
+_next_request_time = 0.0
+
+
+class CachedResponse(object):
+  """ The parts of a requests.Response the scrapers use, reconstituted from the cache.
+  """
+  def __init__(self, content, status_code, encoding, url, fetched, etag=None, last_modified=None):
+    self.content = content
+    self.status_code = status_code
+    self.encoding = encoding
+    self.url = url
+    self.fetched = fetched
+    self.etag = etag
+    self.last_modified = last_modified
+
+  @property
+  def text(self):
+    return str(self.content, self.encoding or 'ISO-8859-1', errors='replace')
+
+
+# configure()
+# -------------------------------------------------------------------------------------------------
+def configure(**kwargs):
+  """ Set one or more of the module’s settings (timeout, max_retries, backoff, requests_per_second,
+      pool_size, cache_dir, max_age, and max_cache_size). Changing pool_size only has an effect
+      before the first request is made.
+  """
+  for key, value in kwargs.items():
+    if key not in _settings:
+      raise TypeError(f'configure() got an unexpected keyword argument “{key}”')
+    if value is not None:
+      globals()[key] = value
+
+
+# session()
+# -------------------------------------------------------------------------------------------------
+def session():
+  """ Return the shared Session, creating it on first use.
+  """
+  global _session
+  with _lock:
+    if _session is None:
+      _session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+      _session.mount('http://', adapter)
+      _session.mount('https://', adapter)
+    return _session
+
+
+# _throttle()
+# -------------------------------------------------------------------------------------------------
+def _throttle():
+  """ Sleep until this thread may start a request without exceeding requests_per_second.
+  """
+  global _next_request_time
+  if not requests_per_second:
+    return
+  with _lock:
+    now = time.monotonic()
+    start_time = max(now, _next_request_time)
+    _next_request_time = start_time + 1.0 / requests_per_second
+  if start_time > now:
+    time.sleep(start_time - now)
+
+
+# _cache_key()
+# -------------------------------------------------------------------------------------------------
+def _cache_key(method, url, data):
+  """ Content address for a request: the hash of its method, URL, and (sorted) form data.
+  """
+  if isinstance(data, dict):
+    data = sorted((str(key), str(value)) for key, value in data.items())
+  request_str = json.dumps([method.upper(), url, data], default=str)
+  return hashlib.sha256(request_str.encode('utf-8')).hexdigest()
+
+
+# _cache_load()
+# -------------------------------------------------------------------------------------------------
+def _cache_load(key):
+  """ Return the CachedResponse for key, or None if there isn’t one. Marks the entry as used.
+  """
+  body_path = Path(cache_dir, f'{key}.body')
+  try:
+    with open(Path(cache_dir, f'{key}.json'), encoding='utf-8') as meta_file:
+      meta = json.load(meta_file)
+    content = body_path.read_bytes()
+    os.utime(body_path)
+  except (OSError, ValueError):
+    return None
+  return CachedResponse(content, meta['status_code'], meta['encoding'], meta['url'],
+                        meta['fetched'], meta.get('etag'), meta.get('last_modified'))
+
+
+# _write_atomically()
+# -------------------------------------------------------------------------------------------------
+def _write_atomically(path, data):
+  fd, temp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+  with os.fdopen(fd, 'wb') as temp_file:
+    temp_file.write(data)
+  os.replace(temp_name, path)
+
+
+# _cache_store()
+# -------------------------------------------------------------------------------------------------
+def _cache_store(key, cached):
+  """ Save a CachedResponse, then evict least-recently used entries if the cache is too big.
+  """
+  global _cache_bytes
+  Path(cache_dir).mkdir(parents=True, exist_ok=True)
+  body_path = Path(cache_dir, f'{key}.body')
+  try:
+    old_size = body_path.stat().st_size
+  except OSError:
+    old_size = 0
+  meta = {'url': cached.url, 'status_code': cached.status_code, 'encoding': cached.encoding,
+          'fetched': cached.fetched, 'etag': cached.etag, 'last_modified': cached.last_modified}
+  _write_atomically(body_path, cached.content)
+  _write_atomically(Path(cache_dir, f'{key}.json'), json.dumps(meta).encode('utf-8'))
+
+  with _cache_lock:
+    if _cache_bytes is None:
+      _cache_bytes = sum(path.stat().st_size for path in Path(cache_dir).glob('*.body'))
+    else:
+      _cache_bytes += len(cached.content) - old_size
+    if _cache_bytes <= max_cache_size:
+      return
+    bodies = sorted(Path(cache_dir).glob('*.body'), key=lambda path: path.stat().st_mtime)
+    for path in bodies:
+      if _cache_bytes <= max_cache_size:
+        break
+      if path == body_path:
+        continue
+      _cache_bytes -= path.stat().st_size
+      path.unlink()
+      path.with_suffix('.json').unlink(missing_ok=True)
+
+
+# request()
+# -------------------------------------------------------------------------------------------------
+def request(method, url, **kwargs):
+  """ Make a request, using the cache if it is enabled. Returns a requests.Response or, when the
+      answer comes from the cache, a CachedResponse.
+  """
+  if cache_dir is None:
+    return _request(method, url, **kwargs)
+
+  key = _cache_key(method, url, kwargs.get('data'))
+  cached = _cache_load(key)
+  if cached is not None:
+    if time.time() - cached.fetched < max_age:
+      return cached
+    headers = dict(kwargs.get('headers') or {})
+    if cached.etag:
+      headers['If-None-Match'] = cached.etag
+    if cached.last_modified:
+      headers['If-Modified-Since'] = cached.last_modified
+    kwargs['headers'] = headers
+
+  response = _request(method, url, **kwargs)
+  if cached is not None and response.status_code == 304:
+    cached.fetched = time.time()
+    _cache_store(key, cached)
+    return cached
+  if response.status_code == 200:
+    _cache_store(key, CachedResponse(response.content, response.status_code,
+                                     response.encoding or response.apparent_encoding, url,
+                                     time.time(), response.headers.get('ETag'),
+                                     response.headers.get('Last-Modified')))
+  return response
+
+
+# _request()
+# -------------------------------------------------------------------------------------------------
+def _request(method, url, **kwargs):
+  """ Make a request using the shared session, retrying transient failures. Returns the
+      requests.Response; raises ConnectionError or Timeout if all attempts fail.
+  """
+  kwargs.setdefault('timeout', timeout)
+  the_session = session()
+  for attempt in range(max_retries + 1):
+    _throttle()
+    try:
+      response = the_session.request(method, url, **kwargs)
+      if response.status_code not in _retry_status_codes or attempt == max_retries:
+        return response
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+      if attempt == max_retries:
+        raise
+    time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def get(url, **kwargs):
+  return request('GET', url, **kwargs)
+
+
+def post(url, data=None, **kwargs):
+  return request('POST', url, data=data, **kwargs)
@@ -1,10 +1,16 @@
 #! /usr/local/bin/python3
 
 from pgconnection import PgConnection
+from pgcopy import copy_rows
 from knowninstitutions import known_institutions
-from cipcodes import cip_codes
+import code_lookups
 
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from hashlib import sha1
+import argparse
+import inspect
 import json
 
 
@@ -46,19 +52,216 @@ def andor_list(items, andor='and'):
   return return_str
 
 
+# The registered_programs columns a row is rendered from: the displayed ones, in display order,
+# then the three that are not displayed as columns of their own.
+Row = namedtuple('Row', 'program_code unit_code institution title formats hegis award '
+                        'certificate_license accreditation first_registration_date '
+                        'last_registration_action tap apts vvta '
+                        'target_institution sed_code is_variant')
+
+# The CUNYfirst plan information used for the CUNY Programs cell.
+Plan_Info = namedtuple('Plan_Info', 'institution academic_plan description department cip_code')
+
+# Everything render_row() depends on for one row. The institution name is for partner schools,
+# which are identified by number; has_requirements tells whether the row’s institution has a dgw
+# requirement block for the (last) plan; short_names and cip_titles are (key, value) pairs.
+Render_Inputs = namedtuple('Render_Inputs', 'row institution_name hegis_description plans '
+                                            'short_names has_requirements cip_titles')
+
+Program_Info = namedtuple('Program_Info', 'program program_title departments')
+
+
+# render_inputs()
+# -------------------------------------------------------------------------------------------------
+def render_inputs(row, known_institutions, hegis_codes, short_names, plans_by_program_code,
+                  block_institutions):
+  """ Gather the Render_Inputs for a Row from the preloaded lookup tables.
+  """
+  if row.institution.isdecimal():
+    institution_name = known_institutions[row.institution][1]
+  else:
+    institution_name = None
+
+  plans = [Plan_Info(plan.institution, plan.academic_plan, plan.description, plan.department,
+                     plan.cip_code) for plan in plans_by_program_code.get(row.program_code, [])]
+  has_requirements = False
+  plan_short_names = dict()
+  if len(plans) > 0:
+    # A requirement block’s institution is a CUNYfirst code, like QNS01, that contains the row’s
+    # institution.
+    institution_lower = row.institution.lower()
+    has_requirements = any(institution_lower in block_institution
+                           for block_institution in block_institutions.get(plans[-1].academic_plan,
+                                                                           ()))
+    for plan in plans:
+      institution_key = plan.institution.lower()[0:3]
+      if institution_key in short_names:
+        plan_short_names[institution_key] = short_names[institution_key]
+
+  cip_titles = [(cip, code_lookups.cip_title(cip))
+                for cip in sorted({plan.cip_code for plan in plans})]
+  return Render_Inputs(row, institution_name, hegis_codes.get(row.hegis), plans,
+                       sorted(plan_short_names.items()), has_requirements, cip_titles)
+
+
+# fingerprint()
+# -------------------------------------------------------------------------------------------------
+def fingerprint(inputs):
+  """ Hash of a row’s Render_Inputs and the render_version().
+  """
+  return sha1(json.dumps([render_version(), inputs], default=str).encode('utf-8')).hexdigest()
+
+
+# render_row()
+# -------------------------------------------------------------------------------------------------
+def render_row(inputs):
+  """ Return the html table row and the JSON-encoded list of csv values for a row, given its
+      Render_Inputs.
+  """
+  # Parallel structures for the HTML and CSV cells
+  row = inputs.row
+
+  # Pick out two parameters for later use
+  if row.is_variant:
+    class_str = ' class="variant"'
+  else:
+    class_str = ''
+  sed_code = row.sed_code
+
+  # Don’t display is_variant (it is indicated by the row’s class), the NYSED Institution Code
+  # (it will be a hover in the HTML version), or the target institution.
+  html_values = list(row[:-3])
+  csv_values = list(row[:-3])
+
+  # If the institution column is a numeric string, it’s a non-CUNY partner school, but the
+  # name is available in the known_institutions dict.
+  if inputs.institution_name is not None:
+    html_values[2] = fix_title(inputs.institution_name)
+    csv_values[2] = html_values[2]
+  # Add hover for sed_code
+  html_values[2] = f'<span title="NYSED Institution ID {sed_code}">{html_values[2]}</span>'
+
+  # Add title with hegis code description to hegis_code column
+  if inputs.hegis_description is not None:
+    description = inputs.hegis_description
+    element_class = ''
+  else:
+    description = 'Unknown HEGIS Code'
+    element_class = ' class="error"'
+  html_values[5] = f'<span title="{description}"{element_class}>{html_values[5]}</span>'
+  csv_values[5] = f'{csv_values[5]} ({description})'
+
+  # Insert list of all CUNY programs (plans) for this program code
+  plans = inputs.plans
+  short_names = dict(inputs.short_names)
+  cuny_cell_html_content = ''
+  cuny_cell_csv_content = ''
+  if len(plans) > 0:
+    # There is just one program and description per college, but the program may be shared
+    # among multiple departments at a college.
+    program_info = dict()
+    for plan in plans:
+      institution_key = plan.institution.lower()[0:3]
+      if institution_key not in program_info.keys():
+        program_info[institution_key] = Program_Info._make([plan.academic_plan,
+                                                           plan.description,
+                                                           []
+                                                            ])
+      program_info[institution_key].departments.append(plan.department)
+
+    # Add information for this institution to the table cell
+    if len(program_info.keys()) > 1:
+      cuny_cell_html_content += '— <em>Multiple Institutions</em> —<br>'
+      cuny_cell_csv_content += 'Multiple Institutions: '
+      show_institution = True
+    else:
+      show_institution = False
+    for inst in program_info.keys():
+      program = program_info[inst].program
+      program_title = program_info[inst].program_title
+      if show_institution:
+        if inst in short_names.keys():
+          inst_str = f'{short_names[inst]}: '
+        else:
+          inst_str = f'{inst}: '
+      else:
+        inst_str = ''
+      departments_str = andor_list(program_info[inst].departments)
+      cuny_cell_html_content += f' {inst_str}{program} ({departments_str})<br>{program_title}'
+      cuny_cell_csv_content += f'{inst_str}{program} ({departments_str})\n{program_title}'
+      # If there is a dgw requirement block for the plan, use link to it.
+      institution = row.institution
+      if inputs.has_requirements:
+        cuny_cell_html_content += (f'<br><a href="/requirements/?college='
+                                   f'{institution.upper() + "01"}'
+                                   f'&requirement-type=MAJOR&requirement-name={program}">'
+                                   f'Requirements</a>')
+        # IDEALLY the host would automatically adjust to the deployment target (ra.qc.cuny.edu,
+        # Heroku, or Lehman, etc). But it's hard-coded here ... for now.
+        host = 'transfer-app.qc.cuny.edu'
+        cuny_cell_csv_content += (f'\nhttps://{host}/requirements/?college='
+                                  f'{institution.upper() + "01"}'
+                                  f'&requirement-type=MAJOR&requirement-name={program}')
+      if show_institution:
+        cuny_cell_html_content += '<br>'
+        cuny_cell_csv_content += '\n'
+  cip_html_cell = [f'<span title="{title}">{cip}</span>' for cip, title in inputs.cip_titles]
+  cip_csv_cell = [f'{cip} ({title.strip(".")})' for cip, title in inputs.cip_titles]
+  html_values.insert(7, '<br>'.join(cip_html_cell))
+  csv_values.insert(7, ', '.join(cip_csv_cell))
+  html_values.insert(8, cuny_cell_html_content)
+  csv_values.insert(8, cuny_cell_csv_content)
+
+  html_cells = ''.join([f'<td>{value}</td>' for value in html_values]).replace("\'", "’")
+
+  return f'<tr{class_str}>{html_cells}</tr>', json.dumps(csv_values)
+
+
+# render_version()
+# -------------------------------------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def render_version():
+  """ A hash of the code that render_row() output depends on: render_row(), fix_title(), and
+      andor_list().
+  """
+  sources = [inspect.getsource(code) for code in (render_row, fix_title, andor_list)]
+  return sha1('\n'.join(sources).encode('utf-8')).hexdigest()
+
+
+# render_rows()
+# -------------------------------------------------------------------------------------------------
+def render_rows(all_inputs, jobs=1):
+  """ Return the list of render_row() results for a list of Render_Inputs, in the same order.
+      With more than one job, the rows are rendered by a pool of processes, in chunks of
+      consecutive rows.
+  """
+  if jobs < 2 or len(all_inputs) < 2:
+    return [render_row(inputs) for inputs in all_inputs]
+
+  chunksize = max(1, len(all_inputs) // (4 * jobs))
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    return list(executor.map(render_row, all_inputs, chunksize=chunksize))
+
+
 # generate_html()
 # -------------------------------------------------------------------------------------------------
-def generate_html():
+def generate_html(incremental=False, jobs=1):
   """ Generate the html for registered programs rows
+      All the information needed from other tables is read up front with a few set-based queries,
+      rather than with per-row (and per-plan) lookups, and the results are written back with a
+      single set-based update.
+      Each row’s html_fingerprint is a hash of everything its html and csv were rendered from. In
+      incremental mode, only rows whose fingerprint has changed are re-rendered and written.
+      Rendering depends only on the Render_Inputs, so with more than one job it is done by a pool
+      of worker processes; the results are the same as with one.
   """
   conn = PgConnection()
   cursor = conn.cursor()
-  plan_cursor = conn.cursor()  # For looking up individual plans in CUNYfirst
 
   # Find out what CUNY colleges are in the db
   cursor.execute("""
                  select distinct r.target_institution as inst, i.name
-                 from registered_programs r, cuny_institutions i, nys_institutions n
+                 from registered_programs r, cuny_institutions i
                  where i.code = upper(r.target_institution||'01')
                  order by i.name
                  """)
@@ -70,23 +273,41 @@ def generate_html():
   cuny_institutions = dict([(row.inst, {'name': row.name})
                            for row in cursor.fetchall()])
 
-  cursor.execute('select hegis_code, description from hegis_codes')
-  hegis_codes = {row.hegis_code: row.description for row in cursor.fetchall()}
-
   # List of short CUNY institution names plus known non-CUNY names
   # Start with the list of all known institutions, then replace CUNY names with their short names.
   short_names = dict()
   for key in known_institutions.keys():
     short_names[key] = known_institutions[key][1]  # value is (prog_code, name, is_cuny)
-  cursor.execute("""
-                    select code, prompt
-                      from cuny_institutions
-                 """)
-  for row in cursor.fetchall():
-    short_names[row.code.lower()[0:3]] = row.prompt
+  for code, cuny_institution in code_lookups.cuny_institutions().items():
+    short_names[code.lower()[0:3]] = cuny_institution.prompt
+
+  # Active CUNYfirst plans, by NYS program code.
+  cursor.execute("""select * from cuny_programs where program_status = 'A'""")
+  plans_by_program_code = dict()
+  for plan in cursor.fetchall():
+    plans_by_program_code.setdefault(plan.nys_program_code, []).append(plan)
+
+  # Lowercase institutions that have a dgw requirement block, by block value.
+  cursor.execute("""select distinct lower(institution) as institution, block_value
+                      from requirement_blocks""")
+  block_institutions = dict()
+  for block in cursor.fetchall():
+    block_institutions.setdefault(block.block_value, set()).add(block.institution)
 
-  # Generate the HTML and CSV values for each row of the respective tables, and save them in the
-  # registered_programs table as html and csv column data.
+  # The fingerprints the rows for each target_institution and program_code were last rendered with.
+  stored_fingerprints = dict()
+  if incremental:
+    cursor.execute("""select distinct target_institution, program_code, html_fingerprint
+                        from registered_programs""")
+    for row in cursor.fetchall():
+      stored_fingerprints.setdefault((row.target_institution, row.program_code),
+                                     set()).add(row.html_fingerprint)
+
+  # The HTML and CSV values are saved in the registered_programs table as html and csv column data
+  # for all rows with the same target_institution and program_code, so the last row (in title
+  # order) for each of those pairs determines what gets saved, and is the only one rendered. The
+  # rest of the primary key breaks ties, so the same row is picked every time, and unchanged rows
+  # keep their fingerprints from one run to the next.
   cursor.execute("""
                  select program_code,
                         unit_code,
@@ -104,141 +325,65 @@ def generate_html():
                         institution_id as sed_code,
                         is_variant
                  from registered_programs, nys_institutions
-                 where nys_institutions.id ~* registered_programs.institution
-                 order by title, program_code
+                 where nys_institutions.id = lower(registered_programs.institution)
+                 order by title, program_code, institution, award, hegis
                  """)
+  rows = dict()
   for row in cursor.fetchall():
-    # Parallel structures for the HTML and CSV cells
+    rows[(row.target_institution, row.program_code)] = Row._make(row)
 
-    # Pick out two parameters for later use
-    if row.is_variant:
-      class_str = ' class="variant"'
-    else:
-      class_str = ''
-    sed_code = row.sed_code
-
-    html_values = list(row)
-    csv_values = list(row)
-
-    # Get rid of the two parameter values that won't be displayed.
-    #   Don’t display is_variant value: it is indicated by the row’s class.
-    html_values.pop()
-    csv_values.pop()
-    #   Don’t display the NYSED Institution Code: it will be a hover in the HTML version
-    html_values.pop()
-    csv_values.pop()
-    #   Don’t display the target institution
-    html_values.pop()
-    csv_values.pop()
-
-    # If the institution column is a numeric string, it’s a non-CUNY partner school, but the
-    # name is available in the known_institutions dict.
-    if html_values[2].isdecimal():
-      html_values[2] = fix_title(known_institutions[html_values[2]][1])
-      csv_values[2] = html_values[2]
-    # Add hover for sed_code
-    html_values[2] = f'<span title="NYSED Institution ID {sed_code}">{html_values[2]}</span>'
-
-    # Add title with hegis code description to hegis_code column
-    try:
-      description = hegis_codes[html_values[5]]
-      element_class = ''
-    except KeyError as ke:
-      description = 'Unknown HEGIS Code'
-      element_class = ' class="error"'
-    html_values[5] = f'<span title="{description}"{element_class}>{html_values[5]}</span>'
-    csv_values[5] = f'{csv_values[5]} ({description})'
-
-    # Insert list of all CUNY programs (plans) for this program code
-    plan_cursor.execute("""select * from cuny_programs
-                           where nys_program_code = %s
-                           and program_status = 'A'""", (html_values[0],))
-    cuny_cell_html_content = ''
-    cuny_cell_csv_content = ''
-    cip_set = set()
-    if plan_cursor.rowcount > 0:
-      plans = plan_cursor.fetchall()
-      # There is just one program and description per college, but the program may be shared
-      # among multiple departments at a college.
-      Program_Info = namedtuple('Program_Info', 'program program_title departments')
-      program_info = dict()
-      program = None
-      program_title = None
-      for plan in plans:
-        cip_set.add(plan.cip_code)
-        institution_key = plan.institution.lower()[0:3]
-        if institution_key not in program_info.keys():
-          program_info[institution_key] = Program_Info._make([plan.academic_plan,
-                                                             plan.description,
-                                                             []
-                                                              ])
-        program_info[institution_key].departments.append(plan.department)
-
-      # Add information for this institution to the table cell
-      if len(program_info.keys()) > 1:
-        cuny_cell_html_content += '— <em>Multiple Institutions</em> —<br>'
-        cuny_cell_csv_content += 'Multiple Institutions: '
-        show_institution = True
-      else:
-        show_institution = False
-      for inst in program_info.keys():
-        program = program_info[inst].program
-        program_title = program_info[inst].program_title
-        if show_institution:
-          if inst in short_names.keys():
-            inst_str = f'{short_names[inst]}: '
-          else:
-            inst_str = f'{inst}: '
-        else:
-          inst_str = ''
-        departments_str = andor_list(program_info[inst].departments)
-        cuny_cell_html_content += f' {inst_str}{program} ({departments_str})<br>{program_title}'
-        cuny_cell_csv_content += f'{inst_str}{program} ({departments_str})\n{program_title}'
-        # If there is a dgw requirement block for the plan, use link to it
-        institution = row.institution
-        plan_cursor.execute("""
-                           select *
-                             from requirement_blocks
-                            where institution ~* %s
-                              and block_value = %s
-                           """, (institution, plan.academic_plan))
-        if plan_cursor.rowcount > 0:
-          cuny_cell_html_content += (f'<br><a href="/requirements/?college='
-                                     f'{institution.upper() + "01"}'
-                                     f'&requirement-type=MAJOR&requirement-name={program}">'
-                                     f'Requirements</a>')
-          # IDEALLY the host would automatically adjust to the deployment target (ra.qc.cuny.edu,
-          # Heroku, or Lehman, etc). But it's hard-coded here ... for now.
-          host = 'transfer-app.qc.cuny.edu'
-          cuny_cell_csv_content += (f'\nhttps://{host}/requirements/?college='
-                                    f'{institution.upper() + "01"}'
-                                    f'&requirement-type=MAJOR&requirement-name={program}')
-        if show_institution:
-          cuny_cell_html_content += '<br>'
-          cuny_cell_csv_content += '\n'
-    cip_html_cell = [f'<span title="{cip_codes(cip)}">{cip}</span>' for cip in sorted(cip_set)]
-    cip_csv_cell = [f'{cip} ({cip_codes(cip).strip(".")})' for cip in sorted(cip_set)]
-    html_values.insert(7, '<br>'.join(cip_html_cell))
-    csv_values.insert(7, ', '.join(cip_csv_cell))
-    html_values.insert(8, cuny_cell_html_content)
-    csv_values.insert(8, cuny_cell_csv_content)
-
-    html_cells = ''.join([f'<td>{value}</td>' for value in html_values]).replace("\'", "’")
-
-    cursor.execute(f"""update registered_programs set html='<tr{class_str}>{html_cells}</tr>'
-                       where target_institution = %s
-                         and program_code = %s
-                    """, (row.target_institution, row.program_code))
-
-    cursor.execute(f"""update registered_programs set csv=%s
-                        where target_institution = %s
-                          and program_code = %s
-                     """, (json.dumps(csv_values), row.target_institution, row.program_code))
+  keys = []
+  all_inputs = []
+  fingerprints = []
+  for key, row in rows.items():
+    inputs = render_inputs(row, known_institutions, code_lookups.hegis_codes(), short_names,
+                           plans_by_program_code, block_institutions)
+    row_fingerprint = fingerprint(inputs)
+    if incremental and stored_fingerprints.get(key) == {row_fingerprint}:
+      continue
+    keys.append(key)
+    all_inputs.append(inputs)
+    fingerprints.append(row_fingerprint)
+
+  rendered = dict()
+  for key, values, row_fingerprint in zip(keys, render_rows(all_inputs, jobs), fingerprints):
+    rendered[key] = values + (row_fingerprint, )
 
+  # COPY the rendered values to a temporary table, and update registered_programs from it.
+  cursor.execute("""create temporary table rendered_programs (
+                      target_institution text,
+                      program_code text,
+                      html text,
+                      csv text,
+                      html_fingerprint text,
+                      primary key (target_institution, program_code)) on commit drop""")
+  copy_rows(cursor, 'rendered_programs',
+            ['target_institution', 'program_code', 'html', 'csv', 'html_fingerprint'],
+            (key + values for key, values in rendered.items()))
+  cursor.execute("""update registered_programs r
+                       set html = t.html, csv = t.csv, html_fingerprint = t.html_fingerprint
+                      from rendered_programs t
+                     where r.target_institution = t.target_institution
+                       and r.program_code = t.program_code""")
   conn.commit()
   conn.close()
+  return len(rendered), len(rows)
 
 
 if __name__ == '__main__':
-  generate_html()
+  parser = argparse.ArgumentParser(description='Generate the html and csv column values for the '
+                                               'registered_programs table')
+  mode = parser.add_mutually_exclusive_group()
+  mode.add_argument('-i', '--incremental', action='store_true', default=False,
+                    help='re-render only rows whose inputs have changed since they were rendered')
+  mode.add_argument('-f', '--full', action='store_true', default=False,
+                    help='re-render all rows (the default)')
+  parser.add_argument('-j', '--jobs', type=int, default=1,
+                      help='number of processes to render rows with (default 1)')
+  parser.add_argument('-v', '--verbose', action='store_true', default=False)
+  args = parser.parse_args()
+
+  num_rendered, num_rows = generate_html(incremental=args.incremental, jobs=args.jobs)
+  if args.verbose:
+    print(f'Rendered {num_rendered:,} of {num_rows:,} programs')
   exit(0)
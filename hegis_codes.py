@@ -5,14 +5,15 @@ from AdvancedHTMLParser import AdvancedHTMLParser
 import requests
 import socket
 
+import fetch
 from pgconnection import PgConnection
 from sendemail import send_message
 
 # Be sure the NYSED website is accessible before proceeding.
 try:
-  r = requests.get('http://www.nysed.gov/college-university-evaluation/'
-                   'new-york-state-taxonomy-academic-programs-hegis-codes').text
-except requests.exceptions.ConnectionError as err:
+  r = fetch.get('http://www.nysed.gov/college-university-evaluation/'
+                'new-york-state-taxonomy-academic-programs-hegis-codes').text
+except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
   send_message([{'name': 'Christopher Vickery', 'email': 'cvickery@qc.cuny.edu'}],
                {'name': 'Transfer App', 'email': 'cvickery@qc.cuny.edu'},
                f'HEGIS Code Update Failed on {socket.gethostname()}',
@@ -1,12 +1,164 @@
-from datetime import date
-from typing import Dict, Tuple
+""" The institutions in the nys_institutions table, by id, and lookups by institution name.
+
+    Nothing is read from the database until one of the lookups is used, so importing this module
+    is free. The table is kept in an on-disk snapshot stamped with the nys_institutions update
+    date; a snapshot younger than snapshot_max_age seconds is used without any database round trip,
+    and an older one is used after a single query confirms that the table has not been updated
+    since it was taken. Set snapshot_path to None to always read the table from the database.
+"""
+import os
+import pickle
+import time
+
+from collections.abc import Mapping
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+
 from pgconnection import PgConnection
 
-known_institutions: Dict[str, Tuple] = dict()
+from aho_corasick import AhoCorasick
+
+snapshot_path = Path(__file__).resolve().parent / 'known_institutions.pickle'
+snapshot_max_age = 24 * 60 * 60.0
+
+
+class _LazyMapping(Mapping):
+  """ A read-only mapping whose contents are built by calling load() the first time it is used.
+  """
+  def __init__(self, load):
+    self._load = load
+    self._table = None
+
+  def _contents(self):
+    if self._table is None:
+      self._table = self._load()
+    return self._table
+
+  def reset(self, table=None):
+    """ Forget the contents, or replace them with table.
+    """
+    self._table = table
+
+  def __getitem__(self, key):
+    return self._contents()[key]
+
+  def __iter__(self):
+    return iter(self._contents())
+
+  def __len__(self):
+    return len(self._contents())
+
+  def __repr__(self):
+    return repr(self._contents())
+
+
+# _read_snapshot()
+# -------------------------------------------------------------------------------------------------
+def _read_snapshot():
+  """ Return (update_date, table, age in seconds) from the snapshot file, or None if there is no
+      usable snapshot.
+  """
+  if snapshot_path is None:
+    return None
+  try:
+    with open(snapshot_path, 'rb') as snapshot_file:
+      update_date, table = pickle.load(snapshot_file)
+    return update_date, table, time.time() - os.stat(snapshot_path).st_mtime
+  except (OSError, EOFError, ValueError, pickle.PickleError):
+    return None
+
+
+# _write_snapshot()
+# -------------------------------------------------------------------------------------------------
+def _write_snapshot(update_date, table):
+  """ Replace the snapshot file, if there is one. Failure is not an error: the snapshot just saves
+      time.
+  """
+  if snapshot_path is None:
+    return
+  temp_path = f'{snapshot_path}.{os.getpid()}'
+  try:
+    with open(temp_path, 'wb') as snapshot_file:
+      pickle.dump((update_date, table), snapshot_file)
+    os.replace(temp_path, snapshot_path)
+  except OSError:
+    pass
+
+
+# _load_known_institutions()
+# -------------------------------------------------------------------------------------------------
+def _load_known_institutions(use_snapshot=True) -> Dict[str, Tuple]:
+  """ Return a dict from id to (institution_id, institution_name, is_cuny), from the snapshot if it
+      is current, otherwise from the nys_institutions table.
+  """
+  snapshot = _read_snapshot() if use_snapshot else None
+  if snapshot is not None and snapshot[2] < snapshot_max_age:
+    return snapshot[1]
+
+  conn = PgConnection()
+  cursor = conn.cursor()
+  cursor.execute("select update_date from updates where table_name = 'nys_institutions'")
+  update_date = str(cursor.fetchone().update_date) if cursor.rowcount > 0 else None
+  if snapshot is not None and update_date is not None and snapshot[0] == update_date:
+    # Still current: restart its clock.
+    table = snapshot[1]
+    try:
+      os.utime(snapshot_path)
+    except OSError:
+      pass
+  else:
+    table = dict()
+    cursor.execute("select * from nys_institutions")
+    for row in cursor.fetchall():
+      table[row.id] = (row.institution_id, row.institution_name, row.is_cuny)
+    if update_date is not None:
+      _write_snapshot(update_date, table)
+  conn.close()
+  return table
+
+
+# _load_ids_by_name()
+# -------------------------------------------------------------------------------------------------
+def _load_ids_by_name() -> Dict[str, List[str]]:
+  """ Reverse index from institution name to the ids with that name, in known_institutions order.
+      (CUNY colleges are there twice: once by TLA and once by NYSED id number.)
+  """
+  table = dict()
+  for key, value in known_institutions.items():
+    table.setdefault(value[1], []).append(key)
+  return table
+
+
+known_institutions = _LazyMapping(_load_known_institutions)
+ids_by_name = _LazyMapping(_load_ids_by_name)
+
+
+# _name_matcher()
+# -------------------------------------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def _name_matcher():
+  """ Names are numbered in order of their first id’s position in known_institutions.
+  """
+  return AhoCorasick(ids_by_name.keys())
+
+
+# refresh_snapshot()
+# -------------------------------------------------------------------------------------------------
+def refresh_snapshot():
+  """ Re-read the nys_institutions table and rewrite the snapshot; for use after updating the table.
+  """
+  known_institutions.reset(_load_known_institutions(use_snapshot=False))
+  ids_by_name.reset()
+  _name_matcher.cache_clear()
+
 
-conn = PgConnection()
-cursor = conn.cursor()
-cursor.execute("select * from nys_institutions")
-for row in cursor.fetchall():
-  known_institutions[row.id] = (row.institution_id, row.institution_name, row.is_cuny)
-conn.close()
+def institution_in(text):
+  """ Return the id of the first institution, in known_institutions order, whose name appears
+      somewhere in text, or None if none does.
+  """
+  matcher = _name_matcher()
+  index = matcher.first_pattern(text)
+  if index is None:
+    return None
+  return ids_by_name[matcher.patterns[index]][0]
@@ -4,11 +4,12 @@ import re
 from datetime import date
 from typing import Dict, Tuple
 
-import requests
 from lxml.html import document_fromstring
 import cssselect
 
+import fetch
 from pgconnection import PgConnection
+from knowninstitutions import refresh_snapshot
 
 """   Institutions that have academic programs registered with NYS Department of Education.
       Includes all known CUNY colleges plus other institutions that have M/I programs with a CUNY
@@ -47,7 +48,7 @@ cuny_institutions['yrk'] = ('33500', 'CUNY YORK COLLEGE')
 # name "searches" and value "1" gets a page with a form with all institutions and ids as options
 # in a select element.
 url = 'http://www.nysed.gov/coms/rp090/IRPSL1'
-r = requests.post(url, data={'searches': 1})
+r = fetch.post(url, data={'searches': 1})
 html_document = document_fromstring(r.content)
 option_elements = [option.text_content() for option in html_document.cssselect('option')]
 if len(option_elements) < 100:
@@ -84,3 +85,6 @@ today = date.today().strftime('%Y-%m-%d')
 cursor.execute(f"update updates set update_date ='{today}' where table_name='nys_institutions'")
 conn.commit()
 conn.close()
+
+# Replace the snapshot of the table that knowninstitutions uses.
+refresh_snapshot()
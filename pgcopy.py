@@ -0,0 +1,40 @@
+""" Helpers for bulk-loading rows into PostgreSQL with COPY ... FROM STDIN (text format).
+"""
+from io import StringIO
+
+# Characters that have to be escaped in COPY text format, and NUL bytes (which NYS sometimes sends),
+# which Postgres text columns cannot hold.
+_copy_escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\x00': None})
+
+
+# copy_line()
+# -------------------------------------------------------------------------------------------------
+def copy_line(values):
+  """ Serialize a row of values as a line of COPY text format: NULLs as \\N, booleans as t/f, and
+      strings with COPY’s special characters escaped and NUL bytes removed.
+  """
+  fields = []
+  for value in values:
+    if value is None:
+      fields.append('\\N')
+    elif value is True or value is False:
+      fields.append('t' if value else 'f')
+    else:
+      fields.append(str(value).translate(_copy_escapes))
+  return '\t'.join(fields) + '\n'
+
+
+# copy_rows()
+# -------------------------------------------------------------------------------------------------
+def copy_rows(cursor, table, columns, rows):
+  """ COPY an iterable of rows (sequences of values in columns order) into table. Returns the
+      number of rows.
+  """
+  buffer = StringIO()
+  num_rows = 0
+  for values in rows:
+    buffer.write(copy_line(values))
+    num_rows += 1
+  buffer.seek(0)
+  cursor.copy_expert(f'copy {table} ({", ".join(columns)}) from stdin', buffer)
+  return num_rows
@@ -1,11 +1,12 @@
-""" The Program class, which is a list of NYS-registered academic programs.
+""" The Program class, which holds information about a NYS-registered academic program, and the
+    ProgramRegistry class, which is a collection of Programs indexed by program code.
 """
 import sys
 import re
-from typing import Dict, Any
-from recordclass import recordclass
+from functools import lru_cache
+from operator import attrgetter
 
-_items = ['institution',
+_items = ('institution',
           'title',
           'award',
           'hegis',
@@ -13,25 +14,65 @@ _items = ['institution',
           'last_registration_action',
           'tap', 'apts', 'vvta',
           'certificate_license',
-          'accreditation']
-_variant_info = recordclass('Variant_Info', _items)
+          'accreditation')
+
+
+class VariantInfo(object):
+  """ The mutable values for one variant of a program. Fields start out as None, and can be accessed
+      as attributes or by name (variant_info['title']). Using __slots__ instead of a per-instance
+      __dict__ keeps the records compact.
+  """
+  __slots__ = _items
+
+  def __init__(self, **kwargs):
+    for field in _items:
+      setattr(self, field, None)
+    for field, value in kwargs.items():
+      setattr(self, field, value)
+
+  def __getitem__(self, field):
+    return getattr(self, field)
+
+  def __setitem__(self, field, value):
+    setattr(self, field, value)
+
+  def __repr__(self):
+    return 'VariantInfo(' + ', '.join(f'{field}={getattr(self, field)!r}' for field in _items) + ')'
+
+
+@lru_cache(maxsize=None)
+def _values_getter(headings):
+  """ Return a function that returns a list of a VariantInfo’s values for a tuple of headings.
+      Headings map to field names by lowercasing, with “ or ” and spaces becoming underscores.
+  """
+  fields = [h.lower().replace(' or ', '_').replace(' ', '_') for h in headings]
+  if len(fields) == 0:
+    return lambda variant_info: []
+  if len(fields) == 1:
+    return lambda variant_info: [getattr(variant_info, fields[0])]
+  getter = attrgetter(*fields)
+  return lambda variant_info: list(getter(variant_info))
 
 
 class Program(object):
   """ For each program registered with NYS Department of Education, collect information about the
       program scraped from the DoE website.
 
-      Some programs appear more than once, so a class list of programs instances prevents duplicate
-      entries.
+      Some programs appear more than once, so Programs are created through a ProgramRegistry, which
+      prevents duplicate entries.
 
       A single program can have multiple variants, which differ in title, institution, award, and/or
       hegis. Emprically, no two variants share the same {award, hegis, and institution} combination,
       so that tuple is used as the key for a dictionary of per-variant values. All variants of a
       programs share a single program code and unit code.
 
-      Variant details are maintained as a recordclass so the values can be updated as new records
-      are retrieved from nys. [A recordclass is like a namedtuple, but the values are mutable.
-      Problem is, recordclass is still in beta ... but seems to be under active development.]
+      Variant details are maintained as VariantInfo records so the values can be updated as new
+      records are retrieved from nys.
+
+      Secondary indexes from award and from institution to variant keys are kept up to date by
+      new_variant() and remove_variant(), so finding or removing the variants for an award and/or
+      institution takes time proportional to the number of matches, not the number of variants.
+      (The indexes are dicts with None values, used as insertion-ordered sets.)
   """
 
   # Default heading strings for the html and values functions. Overrideable in those methods’ calls
@@ -46,60 +87,76 @@ class Program(object):
                'Last Registration Action',
                'TAP', 'APTS', 'VVTA']
 
-  # The (public) programs dict is a class variable, indexed by program_code.
-  programs: Dict[str, Any] = {}
-
-  def __new__(self, program_code, unit_code=None, formats=None):
-    """ Return unique object for this program_code; create it first if necessary.
-    """
-    assert program_code.isdecimal(), f'Invalid program code: “{program_code}”'
-    if program_code not in Program.programs.keys():
-      Program.programs[program_code] = super().__new__(self)
-      Program.programs[program_code].program_code = program_code
-      Program.programs[program_code].unit_code = unit_code
-      Program.programs[program_code].formats = formats
-      Program.programs[program_code].variants = {}
-    return Program.programs[program_code]
+  __slots__ = ('program_code', 'unit_code', 'formats', 'variants', '_by_award', '_by_institution')
 
   def __init__(self, program_code, unit_code='Unknown', formats='Unknown'):
-    assert self.program_code == program_code, f'“{self.program_code}” != “{program_code}”'
-    if self.unit_code is None:
-      self.unit_code = unit_code
-    if self.formats is None:
-      self.formats = formats
+    assert program_code.isdecimal(), f'Invalid program code: “{program_code}”'
+    self.program_code = program_code
+    self.unit_code = unit_code
+    self.formats = formats
+    self.variants = {}
+    self._by_award = {}
+    self._by_institution = {}
 
   def new_variant(self, award, hegis, institution, **kwargs):
     assert re.match(r'\d{4}\.\d{2}', hegis), f'Invalid hegis code: “{hegis}”'
     variant_tuple = (award, hegis, institution)
     if variant_tuple not in self.variants.keys():
-      self.variants[variant_tuple] = _variant_info._make([None] * len(_items))
-      self.variants[variant_tuple].award = award
-      self.variants[variant_tuple].hegis = hegis
-      self.variants[variant_tuple].institution = institution.upper()
+      self.variants[variant_tuple] = VariantInfo(award=award, hegis=hegis,
+                                                 institution=institution.upper())
+      self._by_award.setdefault(award, {})[variant_tuple] = None
+      self._by_institution.setdefault(institution, {})[variant_tuple] = None
     for key in kwargs:
       self.variants[variant_tuple][key] = kwargs[key]
     return variant_tuple
 
+  def remove_variant(self, variant_tuple):
+    """ Remove a variant, if it exists.
+    """
+    if self.variants.pop(variant_tuple, None) is None:
+      return
+    award, hegis, institution = variant_tuple
+    for index, key in ((self._by_award, award), (self._by_institution, institution)):
+      del index[key][variant_tuple]
+      if not index[key]:
+        del index[key]
+
+  def variants_for(self, award=None, institution=None):
+    """ Return a list of the keys of variants with the given award and/or institution, in the
+        order the variants were created.
+    """
+    if award is None and institution is None:
+      return list(self.variants)
+    if institution is None:
+      return list(self._by_award.get(award, ()))
+    if award is None:
+      return list(self._by_institution.get(institution, ()))
+    by_award = self._by_award.get(award, {})
+    by_institution = self._by_institution.get(institution, {})
+    if len(by_institution) < len(by_award):
+      return [variant_tuple for variant_tuple in by_institution if variant_tuple in by_award]
+    return [variant_tuple for variant_tuple in by_award if variant_tuple in by_institution]
+
   @property
   def awards(self):
     """ Return an array of awards for a program’s variants.
         Used for testing if a for-award group applies to this program.
         (Also used in __str__(), below.)
     """
-    return sorted([award for award, hegis, institution in self.variants.keys()])
+    return [award for award in sorted(self._by_award) for variant_tuple in self._by_award[award]]
 
   @classmethod
-  def html_table(this):
-    """ This html table is primarily for testing during development.
-        The transfer app generates html tables from the database info.
+  def html_table(this, programs):
+    """ This html table, of the programs in a ProgramRegistry, is primarily for testing during
+        development. The transfer app generates html tables from the database info.
     """
     table = '<style>.variant {background-color:#fcc;}</style><table>'
     table += '  <tr><th>Program Code</th><th>Registered By</th>'
     table += """<th><a href="http://www.nysed.gov/college-university-evaluation/format-definitions">
                 Formats</a></th>"""
     table += ''.join([f'<th>{head}</th>' for head in this._headings]) + '</tr>\n'
-    for p in this.programs:
-      program = this.programs[p]
+    for p in programs:
+      program = programs[p]
       which_class = ''
       variants = program.variants.keys()
       if len(variants) > 1:
@@ -117,10 +174,28 @@ class Program(object):
         Does not include program-wide values (program code and registration office’s unit code).
     """
     if headings is None:
-      headings = self._headings
-    fields = [h.lower().replace(' or ', '_').replace(' ', '_') for h in headings]
-    return [self.variants[variant_tuple][field] for field in fields]
+      return _default_values(self.variants[variant_tuple])
+    return _values_getter(tuple(headings))(self.variants[variant_tuple])
 
   def __str__(self):
     return (self.__repr__().replace('program.Program object', 'NYS Registered Program')
             + f' {self.program_code} {self.unit_code} {", ".join(self.awards)}')
+
+
+_default_values = _values_getter(tuple(Program._headings))
+
+
+class ProgramRegistry(dict):
+  """ The Programs found during one run, indexed by program_code.
+      Each lookup gets its own registry, so several institutions can be looked up in one process,
+      even concurrently, without sharing Programs; a registry’s Programs are freed with it.
+  """
+
+  def program(self, program_code, unit_code='Unknown', formats='Unknown'):
+    """ Return the Program for this program_code; create it first if necessary.
+    """
+    try:
+      return self[program_code]
+    except KeyError:
+      self[program_code] = Program(program_code, unit_code, formats)
+      return self[program_code]
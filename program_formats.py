@@ -12,10 +12,11 @@ import argparse
 
 from datetime import datetime
 
-import requests
 from lxml.html import document_fromstring
 import cssselect
 
+import fetch
+
 import psycopg2
 from psycopg2.extras import NamedTupleCursor
 
@@ -32,7 +33,7 @@ cursor.execute("""
   """)
 
 # Scrape the state website for the format descriptions.
-r = requests.get('http://www.nysed.gov/college-university-evaluation/format-definitions')
+r = fetch.get('http://www.nysed.gov/college-university-evaluation/format-definitions')
 html_document = document_fromstring(r.content)
 for p in html_document.cssselect('.field__items p'):
   name, description = p.text_content().split(':', 1)
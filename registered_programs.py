@@ -38,60 +38,73 @@ Design Notes
 """
 import argparse
 import csv
+import hashlib
 import os
 import re
 import socket
 import sys
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from io import StringIO
 
 import requests
 from lxml.html import document_fromstring
 import cssselect
 
+import fetch
 from pgconnection import PgConnection
 from sendemail import send_message
-from program import Program
+from program import Program, ProgramRegistry
+from knowninstitutions import known_institutions, ids_by_name, institution_in
+from pgcopy import copy_line
+from details_parser import (parse_details, fix_title, Variant_Line, Not_Granting, For_Award,
+                            Certificate, Eligibility, Accreditation, Registration_Dates)
 
-known_institutions = dict()
-conn = PgConnection()
-cursor = conn.cursor()
-cursor.execute("select * from nys_institutions")
-known_institutions = {row.id: (row.institution_id, row.institution_name, row.is_cuny)
-                      for row in cursor.fetchall()}
-conn.close()
+
+def report_failure(err):
+  """ Notify the maintainer that the update failed, and exit.
+  """
+  send_message([{'name': 'Christopher Vickery', 'email': 'cvickery@qc.cuny.edu'}],
+               {'name': 'Transfer App', 'email': 'cvickery@qc.cuny.edu'},
+               f'Registered Programs Update Failed on {socket.gethostname()}',
+               f'<p>{err}</p>')
+  exit(f'{__file__}: ERROR: {socket.gethostname()} {err}')
 
 
-def detail_lines(all_lines, debug=False):
-  """ Filter out unwanted lines from a details web page for a program code, and yield the others.
+def fetch_details(program_code):
+  """ Return the text of the details web page for a program code.
   """
-  lines = all_lines.splitlines()
-  for line in lines:
-    if re.search(r'^\s+\d{5}\s+|FOR AWARD|PROGRAM|CERTIFICATE|M/A|M/I', line):
-      next_line = line.replace('<H4><PRE>', '').strip()
-      if debug:
-        print(next_line)
-      yield next_line
+  r = fetch.get(f'http://www.nysed.gov/COMS/RP090/IRPSL3?PROGCD={program_code}')
+  return r.text
 
 
-def fix_title(str):
-  """ Create a better titlecase string, taking specifics of this dataset into account.
+def details_pages(program_codes, workers=1):
+  """ Yield (program_code, page_text) pairs in program_codes order.
+      With more than one worker, pages are fetched by a pool of threads, but they are still yielded
+      in the same order as the serial case, so parsing them is deterministic.
   """
-  return (str.strip(' *')
-             .title()
-             .replace('Cuny', 'CUNY')
-             .replace('Mhc', 'MHC')
-             .replace('Suny', 'SUNY')
-             .replace('\'S', '’s')
-             .replace('1St', '1st')
-             .replace('6Th', '6th')
-             .replace(' And ', ' and ')
-             .replace(' Of ', ' of '))
-
-
-def lookup_programs(institution, verbose=False, debug=False):
-  """ Scrape info about academic programs registered with NYS from the Department of Education
-      website. Create a Program object for each program_code.
+  if workers < 2:
+    for program_code in program_codes:
+      try:
+        yield program_code, fetch_details(program_code)
+      except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+        report_failure(err)
+    return
+
+  executor = ThreadPoolExecutor(max_workers=workers)
+  try:
+    yield from zip(program_codes, executor.map(fetch_details, program_codes))
+  except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+    executor.shutdown(wait=False, cancel_futures=True)
+    report_failure(err)
+  executor.shutdown()
+
+
+def fetch_program_list(institution, verbose=False):
+  """ Phase I fetch: return the H4 elements of the NYSED web page listing all programs registered
+      for an institution.
   """
   try:
     institution_id, institution_name, is_cuny = known_institutions[institution]
@@ -102,24 +115,24 @@ def lookup_programs(institution, verbose=False, debug=False):
     else:
       sys.exit(f'Unrecognized institution: {institution}.')
 
-  # Phase I: Get the program code, title, award, hegis, and unit code for all programs
-  # registered for the institution.
   if verbose:
     print(f'Fetching list of registered programs for {institution_name} ...', file=sys.stderr)
   try:
     url = 'http://www.nysed.gov/coms/rp090/IRPS2A'
-    r = requests.post(url, data={'SEARCHES': '1', 'instid': f'{institution_id}'})
+    r = fetch.post(url, data={'SEARCHES': '1', 'instid': f'{institution_id}'})
     html_document = document_fromstring(r.content)
     h4s = [h4.text_content() for h4 in html_document.cssselect('h4')]
     if len(h4s) < 4:
       raise ValueError(f'Got {len(h4s)} H4 elements from {url} for {institution}')
   except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, ValueError) as err:
-    send_message([{'name': 'Christopher Vickery', 'email': 'cvickery@qc.cuny.edu'}],
-                 {'name': 'Transfer App', 'email': 'cvickery@qc.cuny.edu'},
-                 f'Registered Programs Update Failed on {socket.gethostname()}',
-                 f'<p>{err}</p>')
-    exit(f'{__file__}: ERROR: {socket.gethostname()} {err}')
+    report_failure(err)
+  return h4s
+
 
+def build_programs(institution, h4s, registry, debug=False):
+  """ Phase I parse: create a Program in registry, with a variant for the institution, for each
+      program listed in the H4 elements returned by fetch_program_list().
+  """
   # The program codes and unit codes are inside H4 elements, in the following sequence:
   #   PROGRAM CODE  : 36256 - ...
   #   PROGRAM TITLE : [title text] AWARD : [award text]
@@ -134,7 +147,7 @@ def lookup_programs(institution, verbose=False, debug=False):
                         h4)
     if matches:
       program_code = matches.group(1)
-      program = Program(program_code)
+      program = registry.program(program_code)
       this_title = fix_title(matches.group(2))
       this_award = matches.group(3).strip()
       continue
@@ -144,11 +157,7 @@ def lookup_programs(institution, verbose=False, debug=False):
       this_hegis = matches.group(1)
 
       # The institution should match the one that was requested.
-      this_institution = None
-      for inst in known_institutions.keys():
-        if known_institutions[inst][1] in h4:
-          this_institution = inst
-          break
+      this_institution = institution_in(h4)
       if this_institution is None:
         sys.exit(f'Unknown institution in {h4}')
       assert this_institution == institution, f'h4 wrong institution: {this_institution}\n{h4}'
@@ -169,194 +178,347 @@ def lookup_programs(institution, verbose=False, debug=False):
       program.formats = matches.group(1).strip()
       continue
 
-  if verbose:
-    num_programs = len(Program.programs)
-    len_num = len(str(num_programs))
-    print(f'Found {num_programs} registered programs.', file=sys.stderr)
-    print('Fetching details...', file=sys.stderr)
-
   if debug:
-    for p in Program.programs:
-      program = Program.programs[p]
+    for p in registry:
+      program = registry[p]
       print(program.program_code, program.unit_code)
       for v in program.variants:
         print(v, program.values(v))
 
-  # Phase II: Get the details for each program found in Phase I
-  # Structure:
-  # * A program line followed by optional multi-award, and multi-institution lines. These
-  #   lines determine the program variants for a program.
-  # * A for-award line followed by detail liness for that award. There will be one or more for-award
-  #   groups. The details get applied to all variants that include the specified award.
-  #
-  # The following code tests lines in the sequence in which they appear on the details web page.
-  # This is to reduce cognitive load: the tests for line types could be done in any order and the
-  # actual sequence of lines on the details page would make it all work out.
+  return registry
 
-  programs_counter = 0  # For progress reporting in verbose mode
-  for p in Program.programs:
-    program = Program.programs[p]
-    programs_counter += 1
-    if verbose and os.isatty(sys.stdout.fileno()):
-      print(f'Program code: {p} ({programs_counter:{len_num}}/{num_programs})\r',
-            end='', file=sys.stderr)
 
-    for_award = None
-    try:
-      r = requests.get(f'http://www.nysed.gov/COMS/RP090/IRPSL3?PROGCD={program.program_code}')
-    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
-      send_message([{'name': 'Christopher Vickery', 'email': 'cvickery@qc.cuny.edu'}],
-                   {'name': 'Transfer App', 'email': 'cvickery@qc.cuny.edu'},
-                   f'Registered Programs Update Failed on {socket.gethostname()}',
-                   f'<p>{err}</p>')
-      exit(f'{__file__}: ERROR: {socket.gethostname()} {err}')
-
-    # There was a web page that had a 0x1e in the middle of a string of blanks (program code 31441
-    # at CSI), and splitlines() uses this as one of the line boundaries ((Record Separator)), which
-    # broke the first re.match operation below. There is no option for changing the behavior of the
-    # splitlines builtin, so we delete the stray character from all web pages retrieved. By rights,
-    # we should also be deleting \v, \f, \x1c, \x1d, \x85, \u2028, and \u2029 as well. But we don’t.
-    for line in detail_lines(r.text.replace('\x1e', '')):
+def apply_details(program, records, debug=False):
+  """ Phase II update: create, remove, and fill in a program’s variants using the records returned
+      by parse_details() for its details page.
+  """
+  variant_tuples = []
+  for record in records:
+    if isinstance(record, Variant_Line):
+      # Create this variant if necessary
+      if record.title is None:
+        variant = program.new_variant(record.award, record.hegis, record.institution)
+      else:
+        variant = program.new_variant(record.award, record.hegis, record.institution,
+                                      title=record.title)
       if debug:
-        print(line)
-      # Use the first token on a line to determine the type of line.
-      tokens = line.split()
-      token = tokens[0]
-
-      # First token is a numeric string (Program Code #.) or Multi-Award (M/A).
-      if token.isdecimal() or token == 'M/A':
-        # Extract program_code, title, hegis_code, award, institution.
-        matches = re.match(r'\s*(\d+|M/A)\s+(.+)(\d{4}\.\d{2})\s+(\S+\s?\S*)\s+(.+)', line)
-        if matches is None:
-          sys.exit(f'\nUnable to parse program code line for program code {program_code}:\n{line}')
-        # Check the title and hegis for the award. Always set the institution.
-        program_title = fix_title(matches.group(2))
-        program_hegis = matches.group(3)
-        program_award = matches.group(4).strip()
-        program_institution = matches.group(5)
+        print(variant)
 
-        if debug:
-          print(f'Program # or M/A line: {program.program_code}: "{program_title}" {program_hegis}'
-                f' {program_award} "{program_institution}"')
-
-        this_institution = None
-        for key in known_institutions.keys():
-          if program_institution == known_institutions[key][1]:
-            this_institution = key
-            break
-        assert this_institution is not None, f'\n{this_institution}\n{line}'
-
-        # Create this variant if necessary
-        this_variant = program.new_variant(program_award, program_hegis, this_institution,
-                                           title=program_title)
-        continue
-
-      if token == 'M/I':
-        # Extract hegis, award, institution
-        if 'NOT-GRANTING' in line:
-          # If the award is NOT-GRANTING, then variants for this award-institution pair have to be
-          # removed.
-          matches = re.search(r'NOT-GRANTING\s+(.+)', line)
-          if matches is None:
-            sys.exit(f'\nUnable to parse M/I line for program code {program.program_code}:{line}')
-          this_institution = matches.group(1).strip()
-          for inst in known_institutions:
-            if this_institution == known_institutions[inst][1]:
-              for variant_tuple in list(program.variants.keys()):
-                if variant_tuple[0] == program_award and variant_tuple[2] == inst:
-                  program.variants.pop(variant_tuple, None)
-                  if debug:
-                    print(f'Deleted tuple {variant_tuple}')
-        else:
-          matches = re.search(r'(\d{4}.\d{2})\s+(\S+\s?\S*)\s+(.*)', line)
-          if matches is None:
-            sys.exit(f'\nUnable to parse M/I line for program code {program.program_code}:{line}')
-          program_hegis = matches.group(1)
-          program_award = matches.group(2).strip()
-          program_institution_name = matches.group(3).strip()
-          program_institution = None
-          for inst in known_institutions:
-            if program_institution_name == known_institutions[inst][1]:
-              program_institution = inst
-              break
-          assert program_institution is not None, 'Unrecognized institution {} in {}'.format(
-              program_institution_name, line)
-
-          # Create this variant if necessary
-          variant = program.new_variant(program_award, program_hegis, program_institution)
+    elif isinstance(record, Not_Granting):
+      for inst in record.institutions:
+        for variant_tuple in program.variants_for(record.award, inst):
+          program.remove_variant(variant_tuple)
           if debug:
-            print(variant)
-        continue
-
-      if token == 'FOR':
-        # Extract award, and use it to select variant_tuples that will be affected by detail lines
-        # that follow.
-        for_award = re.match(r'\s*FOR AWARD\s*--(.*)', line).group(1).strip()
-        variant_tuples = [variant_tuple for variant_tuple in program.variants
-                          if variant_tuple[0] == for_award]
+            print(f'Deleted tuple {variant_tuple}')
+
+    elif isinstance(record, For_Award):
+      variant_tuples = program.variants_for(record.award)
+      if debug:
+        for variant in variant_tuples:
+          print(variant)
+
+    elif isinstance(record, Certificate):
+      for variant_tuple in variant_tuples:
         if debug:
-          for variant in variant_tuples:
-            print(variant)
-
-      # Detail lines for the currently-identified award.
-      if token.startswith('CERTIFICATE') and for_award is not None:
-        # Extract certificate tuple {name, type, date} if there is one.
-        cert_info = re.sub(r'\s+', ' ', line.split(':')[1].strip())
-        if cert_info.startswith('NONE'):
-          cert_info = ''
-        for variant_tuple in variant_tuples:
-          if debug:
-            print(f'Update {variant_tuple} with cert info “{cert_info}”')
-          program.variants[variant_tuple].certificate_license = cert_info
-        continue
-
-      if token == 'PROGRAM' and tokens[1] == 'FINANCIAL' and for_award is not None:
-        # Extract three booleans.
-        matches = re.search(r'(YES|NO).+(YES|NO).+(YES|NO)', line)
-        if matches is None:
-          sys.exit('\nUnable to parse eligibility line for program code {}:\n{line}'
-                   .format(program.program_code))
-        for variant_tuple in variant_tuples:
-          if debug:
-            print('Update {} with: {} {} {}'.format(variant_tuple,
-                                                    matches.group(1),
-                                                    matches.group(2),
-                                                    matches.group(3)))
-          program.variants[variant_tuple].tap = matches.group(1)
-          program.variants[variant_tuple].apts = matches.group(2)
-          program.variants[variant_tuple].vvta = matches.group(3)
-        continue
-
-      if token == 'PROGRAM' and tokens[1] == 'PROFESSIONAL' and for_award is not None:
-        # Extract text, if any.
-        program_accreditation = line.split(':')[1].strip()
-        for variant_tuple in variant_tuples:
-          if debug:
-            print(f'Update {variant_tuple} with accreditiation: “{program_accreditation}”')
-          program.variants[variant_tuple].accreditation = program_accreditation
-        continue
-
-      if token == 'PROGRAM' and tokens[1] == 'FIRST' and for_award is not None:
-        matches = re.search(r'DATE:\s+(\S+).+ACTION:\s+(\S+)', line)
-        if matches is None:
-          sys.exit('\nUnable to parse registration dates for program code {}:\n{}'
-                   .format(program.program_code, line))
-        first_date = matches[1]
-        last_date = matches[2]
-        for variant_tuple in variant_tuples:
-          if debug:
-            print(f'Update {variant_tuple} with dates: {first_date} {last_date}')
-          if (program.variants[variant_tuple].first_registration_date is None
-                  or first_date.replace('PRE-', '19')
-                  < program.variants[variant_tuple].first_registration_date):
-            program.variants[variant_tuple].first_registration_date = first_date
-          if (program.variants[variant_tuple].last_registration_action is None
-                  or last_date > program.variants[variant_tuple].last_registration_action):
-            program.variants[variant_tuple].last_registration_action = last_date
+          print(f'Update {variant_tuple} with cert info “{record.cert_info}”')
+        program.variants[variant_tuple].certificate_license = record.cert_info
 
+    elif isinstance(record, Eligibility):
+      for variant_tuple in variant_tuples:
+        if debug:
+          print(f'Update {variant_tuple} with: {record.tap} {record.apts} {record.vvta}')
+        program.variants[variant_tuple].tap = record.tap
+        program.variants[variant_tuple].apts = record.apts
+        program.variants[variant_tuple].vvta = record.vvta
+
+    elif isinstance(record, Accreditation):
+      for variant_tuple in variant_tuples:
+        if debug:
+          print(f'Update {variant_tuple} with accreditiation: “{record.accreditation}”')
+        program.variants[variant_tuple].accreditation = record.accreditation
+
+    elif isinstance(record, Registration_Dates):
+      first_date = record.first_date
+      last_date = record.last_date
+      for variant_tuple in variant_tuples:
+        if debug:
+          print(f'Update {variant_tuple} with dates: {first_date} {last_date}')
+        if (program.variants[variant_tuple].first_registration_date is None
+                or first_date.replace('PRE-', '19')
+                < program.variants[variant_tuple].first_registration_date):
+          program.variants[variant_tuple].first_registration_date = first_date
+        if (program.variants[variant_tuple].last_registration_action is None
+                or last_date > program.variants[variant_tuple].last_registration_action):
+          program.variants[variant_tuple].last_registration_action = last_date
+
+
+def parsed_details(program_codes, verbose=False, debug=False, workers=1):
+  """ Phase II fetch and parse: yield (program_code, records) for each program code, in order.
+  """
+  num_programs = len(program_codes)
+  len_num = len(str(num_programs))
+  if verbose:
+    print('Fetching details...', file=sys.stderr)
+  programs_counter = 0  # For progress reporting in verbose mode
+  for program_code, page in details_pages(program_codes, workers):
+    programs_counter += 1
+    if verbose and os.isatty(sys.stdout.fileno()):
+      print(f'Program code: {program_code} ({programs_counter:{len_num}}/{num_programs})\r',
+            end='', file=sys.stderr)
+    try:
+      yield program_code, parse_details(page, program_code, ids_by_name, debug=debug)
+    except ValueError as err:
+      sys.exit(f'\n{err}')
   if verbose:
     print('\r')
-  return Program.programs
+
+
+def lookup_programs(institution, verbose=False, debug=False, workers=1, registry=None):
+  """ Scrape info about academic programs registered with NYS from the Department of Education
+      website. Create a Program object for each program_code in registry (a new ProgramRegistry
+      if None), and return the registry.
+      Phase II details pages are fetched by up to workers threads at a time.
+  """
+  if registry is None:
+    registry = ProgramRegistry()
+  # Phase I: Get the program code, title, award, hegis, and unit code for all programs
+  # registered for the institution.
+  programs = build_programs(institution, fetch_program_list(institution, verbose), registry, debug)
+  if verbose:
+    print(f'Found {len(programs)} registered programs.', file=sys.stderr)
+
+  # Phase II: Get the details for each program found in Phase I
+  for program_code, records in parsed_details(list(programs), verbose, debug, workers):
+    apply_details(programs[program_code], records, debug)
+
+  return programs
+
+
+def lookup_all_programs(institutions, verbose=False, debug=False, workers=1):
+  """ Like lookup_programs(), but for several institutions at once. All the Phase I lists are
+      fetched first, so the details page for a program code shared by several of the institutions
+      (an M/I program) is fetched and parsed just once. Yields (institution, registry) for each
+      institution in turn, with a separate ProgramRegistry for each institution.
+  """
+  h4_lists = {institution: fetch_program_list(institution, verbose) for institution in institutions}
+
+  # Program codes in order of first appearance, and the institutions that registered each one.
+  program_codes = dict()
+  for institution in institutions:
+    for program_code in build_programs(institution, h4_lists[institution], ProgramRegistry()):
+      program_codes.setdefault(program_code, []).append(institution)
+  if verbose:
+    num_shared = len([code for code in program_codes if len(program_codes[code]) > 1])
+    print(f'Found {len(program_codes)} registered programs, {num_shared} of them shared by more '
+          f'than one of the {len(institutions)} institutions.', file=sys.stderr)
+
+  details = dict(parsed_details(list(program_codes), verbose, debug, workers))
+
+  for institution in institutions:
+    programs = build_programs(institution, h4_lists[institution], ProgramRegistry(), debug)
+    for program_code in programs:
+      apply_details(programs[program_code], details[program_code], debug)
+    yield institution, programs
+
+
+def write_csv(institution, programs):
+  """ Generate spreadsheet
+        Apple Numbers does a better job than Microsoft Excel at opening the CSV file.
+        For Excel, it’s better to import it.
+  """
+  file_name = institution.upper() + '_' + date.today().isoformat() + '.csv'
+  with open(file_name, 'w', newline='', encoding='utf-8') as csvfile:
+    writer = csv.writer(csvfile)
+    writer.writerow(['Program Code', 'Registration Office', 'Formats'] + Program._headings)
+    for p in programs:
+      program = programs[p]
+      for program_variant in program.variants:
+        writer.writerow([program.program_code, program.unit_code, program.formats]
+                        + program.values(program_variant))
+
+
+# Columns of the registered_programs table set by update_db(), in db_rows() order.
+db_columns = ['target_institution', 'program_code', 'unit_code', 'institution', 'title', 'award',
+              'formats', 'hegis', 'certificate_license', 'accreditation', 'first_registration_date',
+              'last_registration_action', 'tap', 'apts', 'vvta', 'is_variant']
+
+# The primary key of the registered_programs table.
+db_key = ['target_institution', 'institution', 'program_code', 'award', 'hegis']
+
+
+def db_rows(institution, programs):
+  """ Yield the registered_programs row for each variant of each program, as a list of values.
+  """
+  for p in programs:
+    program = programs[p]
+    is_variant = len(program.variants) > 1
+    for program_variant in program.variants:
+      values = [institution, program.program_code, program.unit_code]
+      values += program.values(program_variant)
+      values += [is_variant]
+      values.insert(6, program.formats)
+      yield values
+
+
+def copy_programs(cursor, table, institution, programs):
+  """ COPY the rows for an institution’s programs into table; return the number of rows.
+      Each row’s content_hash is the SHA-1 of its other values as serialized for COPY.
+  """
+  buffer = StringIO()
+  num_rows = 0
+  for values in db_rows(institution, programs):
+    line = copy_line(values)
+    buffer.write(f'{line[:-1]}\t{hashlib.sha1(line.encode("utf-8")).hexdigest()}\n')
+    num_rows += 1
+  buffer.seek(0)
+  cursor.copy_expert(f'copy {table} ({", ".join(db_columns)}, content_hash) from stdin', buffer)
+  return num_rows
+
+
+def update_db(institution, programs):
+  """ Replace the institution’s rows in the registered_programs table.
+      See registered_programs.sql for the schema of the table, which must already exist.
+      The new rows are sent in one COPY, rather than as one insert per variant.
+  """
+  start_time = time.perf_counter()
+  conn = PgConnection()
+  cursor = conn.cursor()
+  cursor.execute('delete from registered_programs where target_institution=%s',
+                 (institution,))
+  print('Replacing {} entries for {} with info for {} programs.'
+        .format(cursor.rowcount, institution.upper(), len(programs)))
+  num_rows = copy_programs(cursor, 'registered_programs', institution, programs)
+  conn.commit()
+  conn.close()
+  elapsed = time.perf_counter() - start_time
+  print(f'Wrote {num_rows:,} rows for {institution.upper()} in {elapsed:.3f} sec '
+        f'({num_rows / elapsed:,.0f} rows/sec).')
+
+
+class StagedLoad(object):
+  """ Load registered_programs through the unlogged registered_programs_staging table.
+
+      Rows for each institution are COPYed into the staging table, and committed, as they become
+      available, so no transaction is left open while the next institution is being looked up. When
+      all institutions are staged, finish() compares each institution’s row count with the number
+      of rows it has in registered_programs from the previous load, and only if all of them pass
+      replaces those institutions’ rows in a single transaction. Rows whose content_hash has not
+      changed keep their html and csv. Readers never see a partly-loaded registered_programs table,
+      and a failure at any stage leaves it exactly as it was.
+
+      In upsert mode, instead of replacing all of the institutions’ rows, only rows whose primary
+      key is new, whose content_hash changed, or that are no longer staged are inserted, updated,
+      or deleted.
+  """
+
+  def __init__(self, min_ratio=0.8, upsert=False):
+    self.min_ratio = min_ratio
+    self.upsert = upsert
+    self.counts = dict()
+    self.conn = PgConnection()
+    self.cursor = self.conn.cursor()
+    self.cursor.execute("""drop table if exists registered_programs_staging;
+                           create unlogged table registered_programs_staging
+                           (like registered_programs including defaults including constraints)""")
+    self.conn.commit()
+
+  def add(self, institution, programs):
+    """ Stage the rows for an institution.
+    """
+    start_time = time.perf_counter()
+    num_rows = copy_programs(self.cursor, 'registered_programs_staging', institution, programs)
+    self.conn.commit()
+    self.counts[institution] = num_rows
+    elapsed = time.perf_counter() - start_time
+    print(f'Staged {num_rows:,} rows for {institution.upper()} in {elapsed:.3f} sec '
+          f'({num_rows / elapsed:,.0f} rows/sec).')
+
+  def validate(self):
+    """ Return a list of problems with the staged row counts; empty if there are none.
+    """
+    self.cursor.execute("""select target_institution, count(*) as num_rows
+                             from registered_programs
+                            group by target_institution""")
+    previous_counts = {row.target_institution: row.num_rows for row in self.cursor.fetchall()}
+    problems = []
+    for institution, num_rows in self.counts.items():
+      previous = previous_counts.get(institution, 0)
+      if num_rows == 0 or num_rows < self.min_ratio * previous:
+        problems.append(f'{institution.upper()}: {num_rows:,} rows staged; {previous:,} rows '
+                        f'previously loaded')
+    return problems
+
+  def finish(self):
+    """ Validate the staged rows and swap them into registered_programs. Exits if validation
+        fails, leaving registered_programs unchanged.
+    """
+    problems = self.validate()
+    if problems:
+      self.conn.close()
+      sys.exit('Staged registered_programs rows not loaded:\n  ' + '\n  '.join(problems))
+
+    start_time = time.perf_counter()
+    institutions = list(self.counts.keys())
+    if self.upsert:
+      self.merge(institutions)
+    else:
+      # Rows whose content has not changed keep the html and csv generate_html.py rendered for
+      # them, and the fingerprint it rendered them from, so they are not blank until it runs again,
+      # and it does not re-render them.
+      self.cursor.execute(f"""update registered_programs_staging s
+                                 set html = r.html, csv = r.csv,
+                                     html_fingerprint = r.html_fingerprint
+                                from registered_programs r
+                               where ({', '.join(f's.{k}' for k in db_key)})
+                                   = ({', '.join(f'r.{k}' for k in db_key)})
+                                 and s.content_hash = r.content_hash""")
+      columns = ', '.join(db_columns + ['content_hash', 'html', 'csv', 'html_fingerprint'])
+      self.cursor.execute('delete from registered_programs where target_institution = any(%s)',
+                          (institutions, ))
+      num_deleted = self.cursor.rowcount
+      self.cursor.execute(f"""insert into registered_programs ({columns})
+                              select {columns} from registered_programs_staging
+                               where target_institution = any(%s)""", (institutions, ))
+      num_inserted = self.cursor.rowcount
+      print(f'Replaced {num_deleted:,} entries for {len(institutions)} institutions with '
+            f'{num_inserted:,} staged entries.')
+    self.conn.commit()
+    self.conn.close()
+    print(f'Loaded staged entries in {time.perf_counter() - start_time:.3f} sec.')
+
+  def merge(self, institutions):
+    """ Upsert: apply just the differences between the staged rows and registered_programs.
+    """
+    key_list = ', '.join(db_key)
+    columns = ', '.join(db_columns + ['content_hash'])
+    updates = ', '.join(f'{column} = excluded.{column}'
+                        for column in db_columns + ['content_hash'] if column not in db_key)
+
+    self.cursor.execute(f"""delete from registered_programs r
+                             where r.target_institution = any(%s)
+                               and not exists (select 1 from registered_programs_staging s
+                                                where ({', '.join(f's.{k}' for k in db_key)})
+                                                    = ({', '.join(f'r.{k}' for k in db_key)}))""",
+                        (institutions, ))
+    num_deleted = self.cursor.rowcount
+
+    # xmax is zero for newly-inserted rows, and non-zero for ones updated on conflict.
+    self.cursor.execute(f"""insert into registered_programs ({columns})
+                            select {columns} from registered_programs_staging
+                             where target_institution = any(%s)
+                            on conflict ({key_list}) do update set {updates}
+                             where registered_programs.content_hash
+                                   is distinct from excluded.content_hash
+                            returning (xmax = 0) as is_new""", (institutions, ))
+    num_inserted = num_changed = 0
+    for row in self.cursor.fetchall():
+      if row.is_new:
+        num_inserted += 1
+      else:
+        num_changed += 1
+
+    print(f'Upsert for {len(institutions)} institutions: {num_inserted:,} inserted, '
+          f'{num_changed:,} changed, {num_deleted:,} deleted.')
 
 
 """ Command Line Interface
@@ -365,73 +527,88 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='''
                                    Scrape the NYS Department of Education website for information
                                    about academic programs registered for CUNY colleges.''')
-  parser.add_argument('institution')
+  parser.add_argument('institution', nargs='?')
+  parser.add_argument('-a', '--all', action='store_true', default=False,
+                      help='look up all CUNY colleges, fetching shared programs’ details just once')
   parser.add_argument('-u', '--update_db', action='store_true', default=False,
                       help='update info for this institution in the registered_programs database')
+  parser.add_argument('-s', '--staged', action='store_true', default=False,
+                      help='with --update_db, load all institutions through a staging table and '
+                           'replace their rows in one transaction')
+  parser.add_argument('--upsert', action='store_true', default=False,
+                      help='with --staged, change only inserted, changed, or vanished rows')
+  parser.add_argument('--min-ratio', type=float, default=0.8,
+                      help='with --staged, the fraction of its previous row count an institution '
+                           'must have for the load to proceed')
   parser.add_argument('-w', '--html', action='store_true', default=False,
                       help='generate a html table suitable for the web')
   parser.add_argument('-c', '--csv', action='store_true', default=False,
                       help='generate a CSV table')
   parser.add_argument('-d', '--debug', action='store_true', default=False)
   parser.add_argument('-v', '--verbose', action='store_true', default=False)
+  parser.add_argument('--workers', type=int, default=1,
+                      help='number of program details pages to fetch concurrently; --rate '
+                           'is the ceiling, so more workers than about --rate times the seconds a '
+                           'NYSED response takes just wait their turn')
+  parser.add_argument('--rate', type=float, default=fetch.requests_per_second,
+                      help='maximum number of requests per second to send to NYSED')
+  parser.add_argument('--timeout', type=float, default=fetch.timeout,
+                      help='seconds to wait for a NYSED response before retrying')
+  parser.add_argument('--cache-dir', default=None,
+                      help='directory for caching NYSED web pages between runs')
+  parser.add_argument('--max-age', type=float, default=None,
+                      help='seconds a cached page is used before checking NYSED for changes '
+                           '(default: 0, or no limit with --debug)')
   args = parser.parse_args()
+  if args.max_age is None:
+    args.max_age = float('inf') if args.debug else 0.0
+  fetch.configure(requests_per_second=args.rate, timeout=args.timeout,
+                  pool_size=max(fetch.pool_size, args.workers),
+                  cache_dir=args.cache_dir, max_age=args.max_age)
 
   if not args.debug and not args.csv and not args.html and not args.update_db:
     sys.exit('No output options: nothing to do.')
+  if args.upsert and not (args.update_db and args.staged):
+    sys.exit('--upsert requires --update_db and --staged')
+
+  if args.all:
+    if args.institution is not None:
+      sys.exit('Specify an institution or --all, but not both.')
+    institutions = sorted(inst for inst in known_institutions if known_institutions[inst][2])
+    results = lookup_all_programs(institutions, debug=args.debug, verbose=args.verbose,
+                                  workers=args.workers)
+  else:
+    if args.institution is None:
+      sys.exit('No institution: nothing to do.')
+    # Institution ID is a six-digit numeric string or, for CUNY, three letters followed by an
+    # optional 01.
+    if len(args.institution) < 6:
+      institution = args.institution.lower().strip('10')
+    else:
+      institution = args.institution
+    results = [(institution, lookup_programs(institution, debug=args.debug, verbose=args.verbose,
+                                             workers=args.workers))]
 
-  # Institution ID is a six-digit numeric string or, for CUNY, three letters followed by an optional
-  # 01.
-  if len(args.institution) < 6:
-    institution = args.institution.lower().strip('10')
+  if args.update_db and args.staged:
+    staged_load = StagedLoad(args.min_ratio, upsert=args.upsert)
   else:
-    institution = args.institution
+    staged_load = None
 
-  programs = lookup_programs(institution, debug=args.debug, verbose=args.verbose)
-  if programs is not None:
+  for institution, programs in results:
+    if programs is None:
+      sys.exit('lookup_programs failed')
 
     if args.csv:
-      # Generate spreadsheet
-      #   Apple Numbers does a better job than Microsoft Excel at opening the CSV file.
-      #   For Excel, it’s better to import it.
-      file_name = institution.upper() + '_' + date.today().isoformat() + '.csv'
-      with open(file_name, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['Program Code', 'Registration Office', 'Formats'] + Program._headings)
-        for p in Program.programs:
-          program = programs[p]
-          for program_variant in program.variants:
-            writer.writerow([program.program_code, program.unit_code, program.formats]
-                            + program.values(program_variant))
+      write_csv(institution, programs)
 
     if args.html:
       # Generate a HTML table element. Add CSS to highlight rows that have the “variant” class.
-      print(Program.html_table())
-
-    if args.update_db:
-      # See registered_programs.sql for the schema of the table, which must already exist.
-      conn = PgConnection()
-      cursor = conn.cursor()
-      cursor.execute('delete from registered_programs where target_institution=%s',
-                     (institution,))
-      print('Replacing {} entries for {} with info for {} programs.'
-            .format(cursor.rowcount, institution.upper(), len(Program.programs)))
-      for p in Program.programs:
-        program = programs[p]
-        is_variant = len(program.variants) > 1
-        for program_variant in program.variants:
-          values = [institution, program.program_code, program.unit_code]
-          values += program.values(program_variant)
-          values += [is_variant]
-          values.insert(6, program.formats)
-          # deal with nul bytes from NYS
-          for i in range(len(values)):
-            if type(values[i]) is str:
-              values[i] = values[i].replace('\x00', '')
-          cursor.execute('insert into registered_programs values(' + ', '.join(['%s'] * len(values))
-                         + ')', values)
-
-      conn.commit()
-      conn.close()
+      print(Program.html_table(programs))
 
-  else:
-    sys.exit('lookup_programs failed')
+    if staged_load is not None:
+      staged_load.add(institution, programs)
+    elif args.update_db:
+      update_db(institution, programs)
+
+  if staged_load is not None:
+    staged_load.finish()
@@ -21,6 +21,8 @@ create table registered_programs (
   is_variant                boolean default False,
   html                      text default '',
   csv                       text default '',
+  content_hash              text default '',
+  html_fingerprint          text default '',
   primary key (target_institution, institution, program_code, award, hegis)
 );
 
@@ -66,25 +66,33 @@ then echo -n "(Re-)create the registered_programs table ... "
      previous_update_date=`gdate -I`
 fi
 
-# Generate/update the registered_programs table for all colleges
+# Add columns that registered_programs.sql has gained to a table created before they existed. This
+# is done here, in its own short transaction, so the scripts below never have to alter the table
+# while the web app is reading it.
+/usr/local/bin/psql -tqX cuny_curriculum -c "alter table registered_programs \
+                        add column if not exists content_hash text default '', \
+                        add column if not exists html_fingerprint text default ''"
+
+# Generate/update the registered_programs table for all colleges. The --all option fetches the
+# details for programs shared among colleges just once. The --staged option loads them through a
+# staging table and updates all colleges’ rows in one transaction, so a failed update leaves the
+# table as it was, and there is nothing to restore. With --upsert, only rows that are new, changed,
+# or gone are written, so the others keep their html and csv, and generate_html.py --incremental
+# below re-renders just the programs whose rows changed. Five workers are enough to keep to the
+# five requests per second sent to NYSED when pages take about a second to arrive; the rate, not
+# the number of workers, is what limits how fast the details pages are fetched.
 update_date=`gdate -I`
-for inst in bar bcc bkl bmc cty csi grd hos htr jjc kcc lag law leh mec ncc nyt qcc qns sps yrk
-do
-  python3 registered_programs.py -vu $inst
-  if [[ $? != 0 ]]
-  then  echo "Update FAILED for $inst"
-         #  Restore from latest archive
-         restore_from_archive registered_programs
-         update_date=$previous_update_date
-         break
-  fi
-done
+python3 registered_programs.py -vus --upsert --all --workers 5 --rate 5
+if [[ $? != 0 ]]
+then  echo "Update FAILED"
+       update_date=$previous_update_date
+fi
 # Record the date of this update
 /usr/local/bin/psql cuny_curriculum -tqXc "update updates set update_date = '$update_date' \
                         where table_name = 'registered_programs'"
 
 
-# Recreate the requirement_blocks table, using the latest available csv file from OIRA.
+# Update the requirement_blocks table, using the latest available csv file from OIRA.
 (
   cd ./dgw_info
   export latest='./downloads/dap_req_block.csv'
@@ -104,13 +112,13 @@ done
       echo "No new dap_req_block.csv in downloads. Using $latest."
     fi
   fi
-  ./cuny_requirement_blocks.py
+  ./cuny_requirement_blocks.py --incremental
 )
 
 # Generate the HTML and CSV table cols for registered programs (including links to the requirement
-# blocks)
+# blocks). Only rows whose inputs have changed since the last run are re-rendered.
 echo -n 'Generate HTML and CSV column values for registered programs ...'
-./generate_html.py
+./generate_html.py --incremental
 if [[ $? != 0 ]]
 then echo 'FAILED!'
      exit 1